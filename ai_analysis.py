@@ -1,52 +1,135 @@
+import os
+import threading
+import time
 import streamlit as st
-from openai import OpenAI
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-# 1. Access the key correctly from Streamlit secrets
-GROQ_API_KEY = st.secrets.get("GROQ_API_KEY")
+import ai_cache
+import jobs
+import knowledge
+import metrics
 
-def local_analysis(incidents):
-    """Fallback logic to provide basic stats if the AI API fails."""
+# The OpenAI SDK and the analytics engine (numpy/pandas) are imported inside
+# the functions that need them: the login page and the Officer form never do.
+
+DEFAULT_BASE_URL = "https://api.groq.com/openai/v1"
+
+def _secret(name):
+    try:
+        return st.secrets.get(name)
+    except FileNotFoundError:   # no secrets.toml at all
+        return None
+
+# 1. Access the key from Streamlit secrets when a call needs it, not at import
+def groq_api_key():
+    return _secret("GROQ_API_KEY") or os.environ.get("GROQ_API_KEY")
+
+def groq_base_url():
+    # Override to point the app at any OpenAI-compatible server (e.g. a local stub)
+    return _secret("GROQ_BASE_URL") or os.environ.get("GROQ_BASE_URL", DEFAULT_BASE_URL)
+
+LLM_CONNECT_TIMEOUT_S = 5.0
+LLM_READ_TIMEOUT_S = 60.0
+# Retries are handled by jobs.retry (exponential backoff, Retry-After aware)
+# behind a process-wide rate limit, so the client itself does not retry.
+LLM_RETRIES = 5
+LLM_RATE_PER_S = 0.5               # sustained requests per second across all threads
+LLM_BURST = 4
+# Part of that budget is reserved for the chat, so a running audit's
+# map-reduce workers cannot queue an admin's question behind them.
+LLM_CHAT_RATE_PER_S = 0.1
+LLM_CHAT_BURST = 2
+_limiter = jobs.RateLimiter(LLM_RATE_PER_S - LLM_CHAT_RATE_PER_S, burst=LLM_BURST - LLM_CHAT_BURST)
+_chat_limiter = jobs.RateLimiter(LLM_CHAT_RATE_PER_S, burst=LLM_CHAT_BURST)
+
+def _retry_on():
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return (RateLimitError, APIConnectionError, InternalServerError)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Shared LLM client; its connection pool keeps HTTPS connections alive
+    between calls, so only the first request pays for the TLS handshake."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI, Timeout
+
+                _client = OpenAI(
+                    api_key=groq_api_key(),
+                    base_url=groq_base_url(),
+                    timeout=Timeout(LLM_READ_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S),
+                    max_retries=0,
+                )
+    return _client
+
+def local_analysis(incidents, stats=None):
+    """Fallback logic to provide basic stats if the AI API fails.
+
+    Built on the vectorised analytics engine; pass precomputed
+    analytics.analyze() output as stats to skip re-encoding the rows.
+    """
     if not incidents:
         return "No incidents recorded."
 
-    terminals = [row[1] for row in incidents]
-    types = [row[2] for row in incidents]
-    severities = [row[3] for row in incidents]
+    import analytics
 
-    terminal_count = Counter(terminals)
-    type_count = Counter(types)
-    severity_count = Counter(severities)
+    if stats is None:
+        stats = analytics.analyze(analytics.encode(incidents))
+    risk, anomalies = stats["risk"], stats["anomalies"]
 
     report = "📊 Local Safety Analysis (Fallback Mode)\n\n"
-    report += f"Most Affected Terminal: {terminal_count.most_common(1)[0][0]}\n"
-    report += f"Most Common Issue: {type_count.most_common(1)[0][0]}\n"
-    report += f"High Severity Count: {severity_count.get('High', 0)}\n\n"
-    report += "Recommendation: Increase inspection frequency at high-risk terminal."
+    report += f"Most Affected Terminal: {risk.sort_values('Incidents', ascending=False, kind='stable').iloc[0]['Terminal']}\n"
+    report += f"Most Common Issue: {max(stats['by_type'], key=stats['by_type'].get)}\n"
+    report += f"High Severity Count: {stats['by_severity'].get('High', 0)}\n"
+    report += f"Critical Severity Count: {stats['by_severity'].get('Critical', 0)}\n\n"
 
-    return report
+    report += "Severity-Weighted Risk by Terminal:\n"
+    for row in risk.head(5).to_dict("records"):
+        if row["Trend"] == float("inf"):
+            trend = "new activity"
+        else:
+            trend = f"{(row['Trend'] - 1) * 100:+.0f}% vs {analytics.TREND_LONG_DAYS}-day baseline"
+        report += f"- {row['Terminal']}: risk {row['Risk']:.0f} ({row['Risk Share']:.0%} of fleet), last {analytics.TREND_SHORT_DAYS} days {trend}\n"
 
-def analyze_incidents(incidents):
-    """Deep audit model to identify systemic failures from existing logs."""
-    if not GROQ_API_KEY:
-        return "❌ GROQ_API_KEY not found in Streamlit secrets."
+    flagged = anomalies[anomalies["Flagged"]]
+    report += "\nAnomalies (latest week far above history):\n"
+    if flagged.empty:
+        report += "- None detected.\n"
+    for row in flagged.head(5).to_dict("records"):
+        report += (f"- {row['Terminal']} / {row['Incident Type']}: {row['Last Week']} incidents last week"
+                   f" vs {row['Baseline']:.1f} typical (z={row['Z Score']:.1f})\n")
 
-    if not incidents:
-        return "No incidents recorded."
+    import similarity
 
-    try:
-        client = OpenAI(
-            api_key=GROQ_API_KEY,
-            base_url="https://api.groq.com/openai/v1"
-        )
+    clusters = similarity.recurrence_clusters(incidents)
+    report += f"\nRecurring Issues (similar reports at one terminal, last {similarity.RECURRENCE_DAYS} days):\n"
+    if not clusters:
+        report += "- None detected.\n"
+    for cluster in clusters[:5]:
+        report += (f"- {cluster['terminal']}: {len(cluster['ids'])} reports like \"{cluster['description']}\""
+                   f" ({cluster['first'][:10]} to {cluster['last'][:10]})\n")
 
-        # Formatting data for the LLM to parse
-        formatted_data = ""
-        for i, row in enumerate(incidents, 1):
-            formatted_data += f"{i}. [Terminal: {row[1]}] [Type: {row[2]}] [Severity: {row[3]}] - Obs: {row[4]}\n"
+    top = risk.iloc[0]["Terminal"]
+    report += f"\nRecommendation: Increase inspection frequency at {top}"
+    if not flagged.empty:
+        report += f" and investigate the {flagged.iloc[0]['Incident Type']} spike at {flagged.iloc[0]['Terminal']}"
+    if clusters:
+        report += f"; check whether the repeat fault at {clusters[0]['terminal']} was actually fixed"
+    report += "."
+
+    return report
 
-        # The Enhanced Audit Prompt
-        prompt = f"""
+AUDIT_MODEL = "llama-3.3-70b-versatile"
+AUDIT_TEMPERATURE = 0.1 # Low temperature for consistent analytical output
+AUDIT_CACHE_TTL_S = 12 * 60 * 60
+AUDIT_SYSTEM_PROMPT = "You provide high-level maritime safety intelligence and technical risk assessments."
+
+# The Enhanced Audit Prompt
+AUDIT_PROMPT = """
         # ROLE
         You are a Senior Marine Safety Auditor and Risk Management Expert. 
 
@@ -69,33 +152,237 @@ def analyze_incidents(incidents):
         Use professional Markdown, bold key terms, and bullet points.
         """
 
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile", 
-            messages=[
-                {"role": "system", "content": "You provide high-level maritime safety intelligence and technical risk assessments."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1, # Low temperature for consistent analytical output
-        )
+# Map-reduce audit: above SINGLE_PASS_TOKEN_LIMIT the incidents are split into
+# token-budgeted chunks, each chunk is summarised (cached by content hash) and
+# the summaries are reduced into the final audit.
+SINGLE_PASS_TOKEN_LIMIT = 8000
+CHUNK_TOKEN_BUDGET = 4000
+AUDIT_MAX_PARALLEL = 4
+CHUNK_CACHE_TTL_S = 7 * 24 * 60 * 60
+CHUNK_CACHE_MAX_ENTRIES = 20000
+CHUNK_CACHE_MAX_BYTES = 50 * 1024 * 1024
 
-        return response.choices[0].message.content
+CHUNK_PROMPT = """
+        # ROLE
+        You are a Senior Marine Safety Auditor preparing notes for a fleet-wide audit.
 
-    except Exception as e:
-        st.warning("Groq API failed. Providing local summary instead.")
-        return f"{local_analysis(incidents)}\n\n(Error Detail: {str(e)})"
+        # DATASET ({label}, {count} incidents)
+        {formatted_data}
 
-def get_safety_chatbot_response(user_query):
-    """General purpose conversational advisor for work site safety and security."""
-    if not GROQ_API_KEY:
-        return "❌ GROQ_API_KEY not found in Streamlit secrets."
+        # TASK
+        Summarize this slice of the incident log for later aggregation. Include:
+        - Incident counts by severity and by type.
+        - Recurring faults or clusters, naming terminals.
+        - The most serious individual events.
+        - Likely root causes.
+
+        Keep it under 200 words. Use plain bullet points.
+        """
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def format_incidents(incidents):
+    """Formatting data for the LLM to parse"""
+    return "".join(
+        f"{i}. [Terminal: {row[1]}] [Type: {row[2]}] [Severity: {row[3]}] - Obs: {row[4]}\n"
+        for i, row in enumerate(incidents, 1)
+    )
+
+def _record_usage(usage):
+    if usage is not None:
+        metrics.count("llm.prompt_tokens", usage.prompt_tokens or 0)
+        metrics.count("llm.completion_tokens", usage.completion_tokens or 0)
+
+def _create(limiter=None, **params):
+    """chat.completions.create behind a rate limiter (the audit's unless
+    given), retried with backoff.
+
+    Each attempt is timed as llm.request; for a stream that is the time
+    until the response starts, the rest is timed by the caller.
+    """
+    def attempt():
+        with metrics.span("llm.request"):
+            return get_client().chat.completions.create(**params)
+
+    response = jobs.retry(attempt, _retry_on(), attempts=LLM_RETRIES, limiter=limiter or _limiter)
+    if not params.get("stream"):
+        _record_usage(getattr(response, "usage", None))
+    return response
+
+def _complete(messages, temperature=AUDIT_TEMPERATURE):
+    response = _create(
+        model=AUDIT_MODEL,
+        messages=messages,
+        temperature=temperature,
+    )
+    return response.choices[0].message.content
+
+def chunk_incidents(incidents, group_by="terminal", token_budget=CHUNK_TOKEN_BUDGET):
+    """Splits incidents into [(label, rows)] chunks of at most token_budget each.
+
+    Rows are grouped by terminal (or by "month") and cut greedily in id
+    order, so new incidents only change the last chunk of their group and
+    every earlier chunk keeps its cached summary.
+    """
+    if group_by == "terminal":
+        group_key = lambda row: str(row[1] or "Unknown")
+    elif group_by == "month":
+        group_key = lambda row: str(row[6] or "Unknown")[:7]
+    else:
+        raise ValueError(f"Unknown audit grouping: {group_by}")
+
+    groups = {}
+    for row in incidents:
+        groups.setdefault(group_key(row), []).append(row)
+
+    chunks = []
+    for label in sorted(groups):
+        part, used = [], 0
+        for row in groups[label]:
+            cost = estimate_tokens(format_incidents([row]))
+            if part and used + cost > token_budget:
+                chunks.append((label, part))
+                part, used = [], 0
+            part.append(row)
+            used += cost
+        if part:
+            chunks.append((label, part))
+    return chunks
+
+def _summarize(label, count, formatted_data):
+    """Returns (summary, was_cached) for one slice of the dataset."""
+    prompt = CHUNK_PROMPT.format(label=label, count=count, formatted_data=formatted_data)
+    key = ai_cache.fingerprint(AUDIT_MODEL, AUDIT_TEMPERATURE, AUDIT_SYSTEM_PROMPT, prompt)
+    hit = ai_cache.get("audit_chunk", key, ttl=CHUNK_CACHE_TTL_S)
+    if hit:
+        return hit[0], True
+
+    summary = _complete([
+        {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ])
+    ai_cache.put("audit_chunk", key, summary, ttl=CHUNK_CACHE_TTL_S,
+                 max_entries=CHUNK_CACHE_MAX_ENTRIES, max_bytes=CHUNK_CACHE_MAX_BYTES)
+    return summary, False
+
+def _map_reduce(incidents, group_by, progress=None):
+    """Summarises chunks with bounded parallelism, then folds the summaries
+    until they fit one prompt. Returns (dataset_text, stats)."""
+    chunks = chunk_incidents(incidents, group_by)
+    stats = {"chunks": len(chunks), "chunks_cached": 0}
+    done = [0]
+    done_lock = threading.Lock()
+
+    def summarize_chunk(chunk):
+        summary = _summarize(f"{group_by.title()}: {chunk[0]}", len(chunk[1]), format_incidents(chunk[1]))
+        if progress:
+            with done_lock:
+                done[0] += 1
+                # The map step is most of the work; reduce and final pass share the rest
+                progress(0.8 * done[0] / len(chunks), f"Summarised {done[0]}/{len(chunks)} chunks")
+        return summary
+
+    with ThreadPoolExecutor(max_workers=AUDIT_MAX_PARALLEL) as pool:
+        results = list(pool.map(summarize_chunk, chunks))
+        stats["chunks_cached"] = sum(cached for _, cached in results)
+        parts = [(f"{group_by.title()}: {label} ({len(rows)} incidents)", summary)
+                 for (label, rows), (summary, _) in zip(chunks, results)]
+
+        # Hierarchical reduce: merge neighbouring summaries while they overflow
+        while len(parts) > 1 and estimate_tokens("".join(s for _, s in parts)) > SINGLE_PASS_TOKEN_LIMIT:
+            batches, batch, used = [], [], 0
+            for label, summary in parts:
+                cost = estimate_tokens(summary)
+                if batch and used + cost > CHUNK_TOKEN_BUDGET:
+                    batches.append(batch)
+                    batch, used = [], 0
+                batch.append((label, summary))
+                used += cost
+            batches.append(batch)
+            if len(batches) == len(parts):
+                break   # every summary alone fills a batch; cannot shrink further
+            merged = list(pool.map(
+                lambda b: _summarize("Combined summaries", len(b), "\n\n".join(f"## {l}\n{s}" for l, s in b)),
+                batches,
+            ))
+            parts = [(f"{b[0][0]} … {b[-1][0]}", summary) for b, (summary, _) in zip(batches, merged)]
+
+    dataset = f"Summaries of {len(incidents)} incident logs, grouped by {group_by}:\n\n"
+    dataset += "\n\n".join(f"## {label}\n{summary}" for label, summary in parts)
+    return dataset, stats
+
+def run_audit(incidents, use_cache=True, group_by="terminal", progress=None):
+    """Deep audit with a persistent result cache.
+
+    Returns {"report", "cached_at", "chunks", "chunks_cached", "fallback"};
+    cached_at is epoch seconds for a cached report and None for a fresh one,
+    fallback is True when the API failed and the report is the local
+    summary. progress(fraction, message), if given, is called as chunks
+    complete. The cache key
+    fingerprints the formatted dataset, prompt, model and temperature, so
+    unchanged data returns the stored report without calling the API. Large
+    datasets go through the chunked map-reduce path.
+    """
+    result = {"report": "No incidents recorded.", "cached_at": None, "chunks": 0, "chunks_cached": 0, "fallback": False}
+    if not incidents:
+        return result
+
+    formatted_data = format_incidents(incidents)
+    single_pass = estimate_tokens(formatted_data) <= SINGLE_PASS_TOKEN_LIMIT
+    key = ai_cache.fingerprint(AUDIT_MODEL, AUDIT_TEMPERATURE, AUDIT_SYSTEM_PROMPT, AUDIT_PROMPT,
+                               formatted_data, "single" if single_pass else group_by)
+    if use_cache:
+        hit = ai_cache.get("audit", key, ttl=AUDIT_CACHE_TTL_S)
+        if hit:
+            return {**result, "report": hit[0], "cached_at": hit[1]}
+
+    if not groq_api_key():
+        return {**result, "report": "❌ GROQ_API_KEY not found in Streamlit secrets."}
 
     try:
-        client = OpenAI(
-            api_key=GROQ_API_KEY,
-            base_url="https://api.groq.com/openai/v1"
-        )
+        if not single_pass:
+            formatted_data, stats = _map_reduce(incidents, group_by, progress)
+            result.update(stats)
+        if progress:
+            progress(0.9, "Writing the final report")
+
+        report = _complete([
+            {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
+            {"role": "user", "content": AUDIT_PROMPT.format(formatted_data=formatted_data)}
+        ])
+        ai_cache.put("audit", key, report, ttl=AUDIT_CACHE_TTL_S)
+        return {**result, "report": report}
+
+    except Exception as e:
+        # Fallback reports are never cached, so the next click retries the API
+        return {**result, "report": f"{local_analysis(incidents)}\n\n(Error Detail: {str(e)})", "fallback": True}
+
+def submit_audit(incidents, use_cache=True, version=None):
+    """Queues run_audit on the background job runner and returns the job id.
 
-        system_prompt = """
+    Identical requests (same data and cache setting) made while one is still
+    running share that job. Pass the data version to key the job cheaply;
+    otherwise the formatted incidents are fingerprinted. The job gets its own
+    copy of the rows: a caller's list (e.g. IncidentStore's) grows in place
+    on sync, and the audit must fingerprint and summarise the same rows.
+    """
+    incidents = tuple(incidents)
+    data_key = version if version is not None else format_incidents(incidents)
+    key = ai_cache.fingerprint(data_key, use_cache)
+    return jobs.submit("audit", key, run_audit, incidents, use_cache=use_cache)
+
+def analyze_incidents(incidents):
+    """Deep audit model to identify systemic failures from existing logs."""
+    audit = run_audit(incidents)
+    if audit["fallback"]:
+        st.warning("Groq API failed. Providing local summary instead.")
+    return audit["report"]
+
+CHAT_MODEL = "llama-3.3-70b-versatile"
+CHAT_TEMPERATURE = 0.7 # Higher temperature for more conversational helpfulness
+CHAT_SYSTEM_PROMPT = """
         # ROLE
         You are a Work Site Safety & Security Advisor for the Kochi Water Metro. 
         Your expertise covers maritime security, electrical safety, passenger management, 
@@ -111,16 +398,87 @@ def get_safety_chatbot_response(user_query):
         3. If a user describes an active emergency, advise them to contact the command center immediately.
         """
 
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+CHAT_CACHE_TTL_S = 7 * 24 * 60 * 60
+CHAT_PROMPT = """
+        # REFERENCE PASSAGES
+        Excerpts from guideline documents uploaded at the terminals. Base your answer on them
+        where they apply and name the document you used; ignore any that are not relevant.
+
+        {passages}
+
+        # QUESTION
+        {question}
+        """
+
+def chat_prompt(user_query, passages):
+    """The user message: the question, with retrieved passages above it when there are any."""
+    if not passages:
+        return user_query
+    formatted = "\n\n".join(f"[{i}] {knowledge.source_label(p)}:\n{p['text']}" for i, p in enumerate(passages, 1))
+    return CHAT_PROMPT.format(passages=formatted, question=user_query)
+
+def passage_answer(passages):
+    """Local answer from the retrieved passages, for when the model cannot be reached."""
+    answer = "📄 From the uploaded guidelines (offline answer):\n\n"
+    return answer + "\n\n".join(f"**{knowledge.source_label(p)}**\n> {p['text']}" for p in passages)
+
+def stream_safety_chatbot_response(user_query):
+    """Yields the advisor's answer piece by piece as the model produces it.
+
+    The question is grounded in the best matching guideline passages.
+    Answers are cached on the normalised question plus the passages it was
+    given, so a repeat question is answered without calling the model
+    until the documents that answer it change.
+    """
+    knowledge.schedule_indexing()      # documents uploaded since the last run
+    passages = knowledge.search_passages(user_query)
+    cache_key = ai_cache.fingerprint(CHAT_MODEL, CHAT_SYSTEM_PROMPT, CHAT_PROMPT,
+                                     knowledge.normalize_question(user_query), *(p["id"] for p in passages))
+    cached = ai_cache.get("chat", cache_key, ttl=CHAT_CACHE_TTL_S)
+    if cached:
+        metrics.count("chat.cache_hits")
+        yield cached[0]
+        return
+    metrics.count("chat.cache_misses")
+
+    if not groq_api_key():
+        yield passage_answer(passages) if passages else "❌ GROQ_API_KEY not found in Streamlit secrets."
+        return
+
+    pieces = []
+    try:
+        stream = _create(
+            limiter=_chat_limiter,
+            model=CHAT_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_query}
+                {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+                {"role": "user", "content": chat_prompt(user_query, passages)}
             ],
-            temperature=0.7, # Higher temperature for more conversational helpfulness
+            temperature=CHAT_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
         )
-
-        return response.choices[0].message.content
+        started = time.perf_counter()
+        with stream, metrics.span("llm.stream"):
+            for chunk in stream:
+                # include_usage adds a last chunk with no choices, carrying the usage
+                _record_usage(getattr(chunk, "usage", None))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not pieces and metrics.ENABLED:
+                        metrics.observe("llm.first_token", time.perf_counter() - started)
+                    pieces.append(chunk.choices[0].delta.content)
+                    yield pieces[-1]
 
     except Exception as e:
-        return f"Sorry, I am having trouble connecting to the safety knowledge base. Error: {str(e)}"
\ No newline at end of file
+        if passages and not pieces:
+            yield passage_answer(passages)
+        else:
+            yield f"Sorry, I am having trouble connecting to the safety knowledge base. Error: {str(e)}"
+        return
+
+    if pieces:
+        ai_cache.put("chat", cache_key, "".join(pieces), ttl=CHAT_CACHE_TTL_S)
+
+def get_safety_chatbot_response(user_query):
+    """General purpose conversational advisor for work site safety and security."""
+    return "".join(stream_safety_chatbot_response(user_query))
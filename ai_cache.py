@@ -0,0 +1,99 @@
+import hashlib
+import time
+
+from database import connection, transaction
+
+DEFAULT_TTL_S = 24 * 60 * 60
+MAX_ENTRIES = 200                  # per namespace
+MAX_BYTES = 20 * 1024 * 1024       # per namespace
+
+# Persistent cache for LLM outputs. Each caller uses its own namespace
+# ("audit", ...) and a key that fingerprints everything the output depends
+# on, so a changed dataset, prompt or model simply misses.
+AI_CACHE_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS ai_cache (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache(namespace, last_used)",
+)
+
+
+def create_ai_cache_table(conn):
+    """Schema migration step."""
+    for ddl in AI_CACHE_DDL:
+        conn.execute(ddl)
+
+
+def fingerprint(*parts):
+    """Stable sha256 over the given strings."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = str(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))   # length prefix keeps parts unambiguous
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def get(namespace, key, ttl=DEFAULT_TTL_S):
+    """Returns (value, created_at) for a fresh entry, or None."""
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT value, created_at FROM ai_cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+    if row is None or (ttl is not None and time.time() - row[1] > ttl):
+        return None
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE ai_cache SET last_used = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+        )
+    return row
+
+
+def put(namespace, key, value, ttl=DEFAULT_TTL_S, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    """Stores a value, then trims the namespace to its ttl and size limits."""
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_cache (namespace, key, value, created_at, last_used, size) VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, value, now, now, len(value.encode("utf-8"))),
+        )
+        _evict(conn, namespace, max_entries, max_bytes, ttl)
+
+
+def _evict(conn, namespace, max_entries, max_bytes, ttl):
+    if ttl is not None:
+        conn.execute("DELETE FROM ai_cache WHERE namespace = ? AND created_at < ?", (namespace, time.time() - ttl))
+    count, total = conn.execute(
+        "SELECT COUNT(*), IFNULL(SUM(size), 0) FROM ai_cache WHERE namespace = ?", (namespace,)
+    ).fetchone()
+    if count <= max_entries and total <= max_bytes:
+        return
+    doomed = []
+    for key, size in conn.execute(
+        "SELECT key, size FROM ai_cache WHERE namespace = ? ORDER BY last_used", (namespace,)
+    ).fetchall():
+        if count <= max_entries and total <= max_bytes:
+            break
+        doomed.append((namespace, key))
+        count -= 1
+        total -= size
+    conn.executemany("DELETE FROM ai_cache WHERE namespace = ? AND key = ?", doomed)
+
+
+def evict(namespace, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=DEFAULT_TTL_S):
+    """Drops expired entries, then least recently used ones over the limits."""
+    with transaction() as conn:
+        _evict(conn, namespace, max_entries, max_bytes, ttl)
+
+
+def clear(namespace):
+    with transaction() as conn:
+        conn.execute("DELETE FROM ai_cache WHERE namespace = ?", (namespace,))
@@ -0,0 +1,288 @@
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from database import dimension_names, iter_incidents
+
+# Vectorised incident statistics. Rows are reduced once to integer-coded
+# columns (terminal, type, severity weight, day number); every metric below
+# is then a bincount or array operation over those, never a Python loop per
+# incident.
+SEVERITY_WEIGHTS = {"Low": 1, "Medium": 3, "High": 7, "Critical": 15}
+UNKNOWN_SEVERITY_WEIGHT = 1
+
+TREND_SHORT_DAYS = 7
+TREND_LONG_DAYS = 28
+ANOMALY_BUCKET_DAYS = 7        # anomalies compare the latest week with earlier weeks
+ANOMALY_MIN_HISTORY = 4        # weeks of history needed before a group can be flagged
+ANOMALY_Z = 3.0
+ANOMALY_MIN_COUNT = 3          # fewer incidents than this in a week is never an anomaly
+EWMA_ALPHA = 0.3
+
+ANALYTICS_COLUMNS = ("terminal_id", "incident_type_id", "severity_id", "ts")
+
+
+class IncidentColumns:
+    """Integer-coded incident columns plus the labels the codes index into.
+
+    Each (codes, labels) pair has codes in range(len(labels)); day counts
+    whole days from first_day, with -1 for undated incidents.
+    """
+
+    def __init__(self, terminal, incident_type, severity, day, first_day):
+        self.terminal, self.terminals = terminal
+        self.incident_type, self.types = incident_type
+        self.severity, self.severities = severity
+        self.day, self.first_day = day, first_day
+        self.weight = np.array(
+            [SEVERITY_WEIGHTS.get(s, UNKNOWN_SEVERITY_WEIGHT) for s in self.severities], dtype=np.float64
+        )[self.severity] if len(self.severity) else np.zeros(0)
+
+    def __len__(self):
+        return len(self.terminal)
+
+
+def _codes(values):
+    codes, labels = pd.factorize(np.array(values, dtype=object), sort=True)
+    labels = [str(label) for label in labels]
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels.append("Unknown")
+    return codes.astype(np.int32), labels
+
+
+def _days(dates):
+    """Day numbers relative to the earliest date; -1 where the date is missing.
+
+    Only distinct calendar days are parsed, so a million timestamps cost one
+    slice each plus a parse per day actually present.
+    """
+    days = np.array([d[:10] if isinstance(d, str) else None for d in dates], dtype=object)
+    codes, uniques = pd.factorize(days)
+    if not len(uniques):
+        return np.full(len(days), -1, dtype=np.int32), None
+    parsed = pd.to_datetime(pd.Series(uniques), format="%Y-%m-%d", errors="coerce").to_numpy("datetime64[D]")
+    valid = ~np.isnat(parsed)
+    if not valid.any():
+        return np.full(len(days), -1, dtype=np.int32), None
+    first = parsed[valid].min()
+    offsets = np.where(valid, (parsed - first).astype(np.int64), -1)
+    day = np.where(codes >= 0, offsets[np.maximum(codes, 0)], -1).astype(np.int32)
+    return day, first
+
+
+def _key_codes(keys, names):
+    """Codes for dimension keys given the {key: name} table; NULL keys become "Unknown"."""
+    ids = sorted(names)
+    labels = [names[key] for key in ids]
+    lookup = np.full(max(ids, default=0) + 2, len(labels), dtype=np.int32)   # last slot: NULL
+    lookup[ids] = np.arange(len(ids))
+    keys = np.nan_to_num(np.asarray(keys, dtype=np.float64), nan=-1).astype(np.int64)
+    codes = lookup[keys]
+    if (codes == len(labels)).any():
+        labels.append("Unknown")
+    return codes, labels
+
+
+def _ts_days(ts):
+    ts = np.asarray(ts, dtype=np.float64)
+    dated = ~np.isnan(ts)
+    if not dated.any():
+        return np.full(len(ts), -1, dtype=np.int32), None
+    epoch_day = np.floor(ts[dated] / 86400).astype(np.int64)
+    first = epoch_day.min()
+    day = np.full(len(ts), -1, dtype=np.int32)
+    day[dated] = epoch_day - first
+    return day, np.datetime64(int(first), "D")
+
+
+def encode(incidents):
+    """IncidentColumns from incident row tuples (id, terminal, type, severity, ..., date, ...).
+
+    For rows already in memory. The names are factorized and the dates sliced
+    in Python, about 1.2 s per million rows, so load() is the faster path
+    from the database.
+    """
+    # One pass per needed column; transposing whole rows with zip is several times slower
+    terminal, incident_type, severity, date = (list(map(itemgetter(i), incidents)) for i in (1, 2, 3, 6))
+    return IncidentColumns(_codes(terminal), _codes(incident_type), _codes(severity), *_days(date))
+
+
+def load(chunk_size=50000, **filters):
+    """IncidentColumns straight from SQLite.
+
+    Reads the integer dimension keys and ts only, so nothing is factorized
+    or parsed: keys map to codes with one searchsorted per column. Each chunk
+    becomes one float array (NULL keys and ts turn into NaN), and id is read
+    too, so iter_incidents hands the rows over as they are. Expect about 2 s
+    per million incidents, most of it SQLite producing the rows.
+    """
+    chunks = [
+        np.array(rows, dtype=np.float64)
+        for rows in iter_incidents(columns=("id",) + ANALYTICS_COLUMNS, chunk_size=chunk_size, **filters)
+    ]
+    table = np.concatenate(chunks) if chunks else np.empty((0, len(ANALYTICS_COLUMNS) + 1))
+    return IncidentColumns(
+        _key_codes(table[:, 1], dimension_names("terminal")),
+        _key_codes(table[:, 2], dimension_names("incident_type")),
+        _key_codes(table[:, 3], dimension_names("severity")),
+        *_ts_days(table[:, 4]),
+    )
+
+
+def _daily_matrix(group, n_groups, day, n_days):
+    """counts[g, d] for dated rows, via one bincount over g * n_days + d."""
+    dated = day >= 0
+    flat = group[dated].astype(np.int64) * n_days + day[dated]
+    return np.bincount(flat, minlength=n_groups * n_days).reshape(n_groups, n_days)
+
+
+def _window_sum(counts, days):
+    """Per-row sum over the last `days` columns."""
+    cum = np.concatenate([np.zeros((counts.shape[0], 1)), np.cumsum(counts, axis=1)], axis=1)
+    end = cum.shape[1] - 1
+    return cum[:, end] - cum[:, max(end - days, 0)]
+
+
+def risk_scores(cols):
+    """Per-terminal counts, severity-weighted risk and recent trend, riskiest first."""
+    n = len(cols.terminals)
+    if not len(cols):
+        return pd.DataFrame(columns=["Terminal", "Incidents", "Risk", "Risk Share", "Recent Rate", "Baseline Rate", "Trend"])
+    count = np.bincount(cols.terminal, minlength=n)
+    risk = np.bincount(cols.terminal, weights=cols.weight, minlength=n)
+
+    n_days = int(cols.day.max()) + 1 if (cols.day >= 0).any() else 0
+    if n_days:
+        daily = _daily_matrix(cols.terminal, n, cols.day, n_days)
+        short = _window_sum(daily, TREND_SHORT_DAYS) / TREND_SHORT_DAYS
+        long_total = _window_sum(daily, TREND_SHORT_DAYS + TREND_LONG_DAYS) - short * TREND_SHORT_DAYS
+        baseline = long_total / TREND_LONG_DAYS
+    else:
+        short = baseline = np.zeros(n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend = np.where(baseline > 0, short / baseline, np.where(short > 0, np.inf, 1.0))
+
+    frame = pd.DataFrame({
+        "Terminal": cols.terminals,
+        "Incidents": count,
+        "Risk": risk,
+        "Risk Share": risk / risk.sum(),
+        "Recent Rate": short,
+        "Baseline Rate": baseline,
+        "Trend": trend,
+    })
+    return frame.sort_values("Risk", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def _trend_frame(first_day, counts):
+    """Date, count and trailing short and long means for consecutive days from first_day."""
+    cum = np.concatenate([[0], np.cumsum(counts)])
+    idx = np.arange(1, len(counts) + 1)
+
+    def rolling(window):
+        start = np.maximum(idx - window, 0)
+        return (cum[idx] - cum[start]) / np.minimum(idx, window)
+
+    return pd.DataFrame({
+        "Date": first_day + np.arange(len(counts)).astype("timedelta64[D]"),
+        "Incidents": counts,
+        f"{TREND_SHORT_DAYS}d Avg": rolling(TREND_SHORT_DAYS),
+        f"{TREND_LONG_DAYS}d Avg": rolling(TREND_LONG_DAYS),
+    })
+
+
+def _empty_trend():
+    return pd.DataFrame(columns=["Date", "Incidents", f"{TREND_SHORT_DAYS}d Avg", f"{TREND_LONG_DAYS}d Avg"])
+
+
+def daily_trend(cols):
+    """Fleet-wide incidents per day with trailing short and long rolling means."""
+    if cols.first_day is None:
+        return _empty_trend()
+    return _trend_frame(cols.first_day, np.bincount(cols.day[cols.day >= 0]))
+
+
+def daily_trend_from_counts(days, counts):
+    """daily_trend() from ('YYYY-MM-DD', count) pairs, as database.daily_counts()
+    gives them, so no incident row is read. Empty days are skipped."""
+    dated = [(day, count) for day, count in zip(days, counts) if day]
+    if not dated:
+        return _empty_trend()
+    day = np.array([d for d, _ in dated], dtype="datetime64[D]")
+    first = day.min()
+    totals = np.bincount((day - first).astype(np.int64), weights=[c for _, c in dated]).astype(np.int64)
+    return _trend_frame(first, totals)
+
+
+def anomalies(cols, z_threshold=ANOMALY_Z, alpha=EWMA_ALPHA):
+    """Terminal/type pairs whose latest week is far above their own history.
+
+    Weekly counts per pair are bucketed back from the newest day, so the
+    last bucket is always a full week. A pair is flagged when that week has
+    at least ANOMALY_MIN_COUNT incidents, is z_threshold standard deviations
+    above the mean of earlier weeks and also that far above their EWMA.
+    """
+    columns = ["Terminal", "Incident Type", "Last Week", "Baseline", "Z Score", "EWMA", "Flagged"]
+    dated = cols.day >= 0
+    if not dated.any():
+        return pd.DataFrame(columns=columns)
+
+    n_types = len(cols.types)
+    group = cols.terminal[dated].astype(np.int64) * n_types + cols.incident_type[dated]
+    last_day = int(cols.day[dated].max())
+    week = (last_day - cols.day[dated]) // ANOMALY_BUCKET_DAYS       # 0 = latest week
+    n_weeks = int(week.max()) + 1
+    n_groups = len(cols.terminals) * n_types
+    weekly = np.bincount(group * n_weeks + (n_weeks - 1 - week), minlength=n_groups * n_weeks)
+    weekly = weekly.reshape(n_groups, n_weeks).astype(np.float64)
+
+    present = weekly.sum(axis=1) > 0
+    weekly, ids = weekly[present], np.flatnonzero(present)
+    history, latest = weekly[:, :-1], weekly[:, -1]
+    n_hist = history.shape[1]
+    if n_hist:
+        mean = history.mean(axis=1)
+        std = history.std(axis=1)
+    else:
+        mean = std = np.zeros(len(latest))
+
+    ewma = history[:, 0].copy() if n_hist else np.zeros(len(latest))
+    ewvar = np.zeros(len(latest))
+    for t in range(1, n_hist):          # loops over weeks; each step is vectorised over all pairs
+        diff = history[:, t] - ewma
+        ewma += alpha * diff
+        ewvar = (1 - alpha) * (ewvar + alpha * diff * diff)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, (latest - mean) / std, np.where(latest > mean, np.inf, 0.0))
+    enough = n_hist >= ANOMALY_MIN_HISTORY
+    flagged = enough & (latest >= ANOMALY_MIN_COUNT) & (z >= z_threshold) & (
+        latest > ewma + z_threshold * np.sqrt(ewvar)
+    )
+
+    frame = pd.DataFrame({
+        "Terminal": np.array(cols.terminals, dtype=object)[ids // n_types],
+        "Incident Type": np.array(cols.types, dtype=object)[ids % n_types],
+        "Last Week": latest.astype(np.int64),
+        "Baseline": mean,
+        "Z Score": z,
+        "EWMA": ewma,
+        "Flagged": flagged,
+    })
+    return frame.sort_values(["Flagged", "Z Score"], ascending=False, kind="stable").reset_index(drop=True)
+
+
+def analyze(cols):
+    """Every metric at once, for the fallback report and the dashboard."""
+    severity_counts = np.bincount(cols.severity, minlength=len(cols.severities))
+    type_counts = np.bincount(cols.incident_type, minlength=len(cols.types))
+    return {
+        "total": len(cols),
+        "by_severity": {name: n for name, n in zip(cols.severities, severity_counts.tolist()) if n},
+        "by_type": {name: n for name, n in zip(cols.types, type_counts.tolist()) if n},
+        "risk": risk_scores(cols),
+        "daily": daily_trend(cols),
+        "anomalies": anomalies(cols),
+    }
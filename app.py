@@ -1,29 +1,42 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import plotly.express as px
+import functools
 import os
-
-from database import init_db, insert_incident, get_all_incidents
-from auth import create_default_users, login
-# Ensure get_safety_chatbot_response is imported from your ai_analysis file
-from ai_analysis import analyze_incidents, get_safety_chatbot_response
+import time
+
+from database import INCIDENT_TYPES, SEVERITIES, TERMINALS, get_incidents, insert_incident, migrate, transaction
+from auth import login
+import archive
+import dashboard
+import export
+import file_storage
+import incident_feed
+import jobs
+import knowledge
+import metrics
+import thumbnails
+# Ensure stream_safety_chatbot_response is imported from your ai_analysis file
+from ai_analysis import submit_audit, stream_safety_chatbot_response
 
 # -----------------------------
 # 1. Initialize System
 # -----------------------------
-init_db()
-create_default_users()
-UPLOAD_DIR = "uploaded_evidence"  # This defines the variable name
-if not os.path.exists(UPLOAD_DIR): # This creates the actual folder on your PC
-    os.makedirs(UPLOAD_DIR)
-
-st.set_page_config(page_title="Water Metro Safety", layout="wide")
-
-# -----------------------------
-# 2. THEME, DE-BRANDING & FLOATING CHAT CSS
-# -----------------------------
-st.markdown(f"""
+# Schema migrations run once per process; later reruns skip straight past
+migrate()
+# Each rerun is timed section by section when metrics are on (see metrics.py)
+with metrics.script_run(st.session_state.get("role") or "Login"):
+    EXPLORER_PAGE_SIZE = 20
+    AUDIT_POLL_SECONDS = 2
+    UPLOAD_DIR = file_storage.UPLOAD_ROOT  # This defines the variable name
+    if not os.path.exists(UPLOAD_DIR): # This creates the actual folder on your PC
+        os.makedirs(UPLOAD_DIR)
+
+    st.set_page_config(page_title="Water Metro Safety", layout="wide")
+
+    # -----------------------------
+    # 2. THEME, DE-BRANDING & FLOATING CHAT CSS
+    # -----------------------------
+    st.markdown(f"""
 <style>
 /* Hide Streamlit Branding & Creator Profile */
 # header {{visibility: hidden;}}
@@ -126,196 +139,225 @@ div[data-testid="stPopoverBody"] {{
 </style>
 """, unsafe_allow_html=True)
 
-# -----------------------------
-# 3. HEADER SECTION
-# -----------------------------
-header_col1, header_col2 = st.columns([1, 6])
+    # -----------------------------
+    # 3. HEADER SECTION
+    # -----------------------------
+    header_col1, header_col2 = st.columns([1, 6])
 
-with header_col1:
-    try:
-        st.image("assets/logo.png", width=100)
-    except Exception:
-        st.error("Logo missing")
+    with header_col1:
+        try:
+            st.image("assets/logo.png", width=100)
+        except Exception:
+            st.error("Logo missing")
 
-with header_col2:
-    st.markdown("""
+    with header_col2:
+        st.markdown("""
 <div style="padding-top: 5px;">
 <h1 style="margin-bottom: 0px; color: #a2ffff !important;">Water Metro Safety System</h1>
 <p style="opacity: 0.8; font-size: 1.1em; letter-spacing: 1px;">KOCHI METRO RAIL LIMITED | AUDIT PORTAL</p>
 </div>
 """, unsafe_allow_html=True)
 
-st.markdown("---")
-
-# -----------------------------
-# 4. SESSION STATE & AUTH
-# -----------------------------
-if "role" not in st.session_state:
-    st.session_state.role = None
-
-if st.session_state.role is None:
-    _, login_box, _ = st.columns([1, 1.5, 1])
-    with login_box:
-        st.subheader("🔐 Authentication")
-        username = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-
-        if st.button("Authenticate"):
-            role = login(username, password)
-            if role:
-                st.session_state.role = role
-                st.success("Access Granted")
-                st.rerun()
-            else:
-                st.error("Invalid Credentials")
+    st.markdown("---")
 
-# -----------------------------
-# 5. DASHBOARD PANELS
-# -----------------------------
-else:
-    st.sidebar.markdown(f"### Welcome, \n**{st.session_state.role}**")
-    if st.sidebar.button("Logout", type="secondary"):
+    # -----------------------------
+    # 4. SESSION STATE & AUTH
+    # -----------------------------
+    if "role" not in st.session_state:
         st.session_state.role = None
-        st.rerun()
-
-    # =====================================
-    # OFFICER PANEL
-    # =====================================
-    if st.session_state.role == "Officer":
-
-        st.subheader("📝 New Incident Report")
-
-        with st.form("incident_entry"):
-            terminal = st.selectbox("Terminal Location", [
-                "High Court", "Vyttila", "Kakkanad", "Fort Kochi",
-                "Vypin", "Bolgatty", "South Chittoor", "Cheranallur",
-                "Eloor", "Mulavukad North", "Willingdon Island", "Mattancherry"
-            ])
-
-            incident_type = st.selectbox(
-                "Incident Category",
-                ["Mechanical", "Electrical", "Injury", "Security", "Environmental"]
-            )
-
-            severity = st.selectbox(
-                "Severity Level",
-                ["Low", "Medium", "High", "Critical"]
-            )
-
-            description = st.text_area("Observations / Details")
-            action_taken = st.text_area("Immediate Response Taken")
-
-            st.write("📸 Evidence Upload")
-            up_file = st.file_uploader("Upload Image/PDF", type=['png', 'jpg', 'jpeg', 'pdf'])
-
-            if st.form_submit_button("Submit Report"):
-
-                file_path = None
 
-                if up_file:
-                    # Create terminal-based folder
-                    terminal_folder = os.path.join(UPLOAD_DIR, terminal)
-                    os.makedirs(terminal_folder, exist_ok=True)
-
-                    file_path = os.path.join(terminal_folder, up_file.name)
-
-                    with open(file_path, "wb") as f:
-                        f.write(up_file.getbuffer())
-
-                insert_incident((
-                    terminal,
-                    incident_type,
-                    severity,
-                    description,
-                    action_taken,
-                    str(datetime.datetime.now()),
-                    file_path
-                ))
-
-                st.success("✅ Report Synced to Command Center.")
-
-
-    # =====================================
-    # ADMIN PANEL
-    # =====================================
-    elif st.session_state.role == "Admin":
-        st.subheader("📊 Intelligent FRACAS")
-        incidents = get_all_incidents()
-
-        if incidents:
-            df = pd.DataFrame(incidents, columns=["ID", "Terminal", "Incident Type", "Severity", "Description", "Action Taken", "Date","Evidence"])
-
-            # --- 1. KPI METRICS ---
-            m1, m2, m3, m4 = st.columns(4)
-            m1.metric("Total Logs", len(df))
-            m2.metric("Critical Alerts", len(df[df["Severity"] == "Critical"]))
-            score = 100 - (len(df[df['Severity'] == 'Critical']) * 10)
-            m3.metric("Safety Score", f"{max(score, 0)}%")
-            
-            csv = df.to_csv(index=False).encode('utf-8')
-            m4.download_button("📥 Export CSV", data=csv, file_name=f'KMRL_Audit_{datetime.date.today()}.csv', mime='text/csv')
-
-            st.markdown("---")
+    if st.session_state.role is None:
+        _, login_box, _ = st.columns([1, 1.5, 1])
+        with login_box:
+            st.subheader("🔐 Authentication")
+            username = st.text_input("Username")
+            password = st.text_input("Password", type="password")
+
+            if st.button("Authenticate"):
+                role = login(username, password)
+                if role:
+                    st.session_state.role = role
+                    st.success("Access Granted")
+                    st.rerun()
+                else:
+                    st.error("Invalid Credentials")
+
+    # -----------------------------
+    # 5. DASHBOARD PANELS
+    # -----------------------------
+    else:
+        st.sidebar.markdown(f"### Welcome, \n**{st.session_state.role}**")
+        if st.sidebar.button("Logout", type="secondary"):
+            st.session_state.role = None
+            st.rerun()
+
+        if st.session_state.role == "Admin":
+            auto_poll = st.sidebar.toggle("Auto-refresh incidents", value=False)
+            poll_every = st.sidebar.number_input("Refresh interval (seconds)", min_value=5, value=dashboard.POLL_INTERVAL_SECONDS, step=5, disabled=not auto_poll)
+            stats = dashboard.cache_stats()
+            st.sidebar.caption(f"Dashboard cache: {stats['hits']} hits / {stats['misses']} misses")
+            # Process-wide switch, so only flip it when this admin changes it
+            st.sidebar.toggle("Collect performance metrics", value=metrics.ENABLED, key="collect_metrics",
+                              on_change=lambda: metrics.enable(st.session_state.collect_metrics))
+
+        # =====================================
+        # OFFICER PANEL
+        # =====================================
+        if st.session_state.role == "Officer":
+
+            metrics.section("officer.form")
+            st.subheader("📝 New Incident Report")
+
+            with st.form("incident_entry"):
+                terminal = st.selectbox("Terminal Location", TERMINALS)
+
+                incident_type = st.selectbox("Incident Category", INCIDENT_TYPES)
+
+                severity = st.selectbox("Severity Level", SEVERITIES)
+
+                description = st.text_area("Observations / Details")
+                action_taken = st.text_area("Immediate Response Taken")
+
+                st.write("📸 Evidence Upload")
+                up_file = st.file_uploader("Upload Image/PDF", type=['png', 'jpg', 'jpeg', 'pdf'])
+
+                if st.form_submit_button("Submit Report"):
+                    # The similarity index needs numpy, so it is loaded on the first
+                    # submission rather than on the way to the login form
+                    import similarity
+
+                    # A report that reads like a recent one from the same terminal is
+                    # held back once; submitting the same text again files it anyway
+                    duplicate = similarity.find_duplicate(description, action_taken, terminal)
+                    report_key = (terminal, description, action_taken)
+                    found = []
+                    if duplicate and st.session_state.get("duplicate_ack") != report_key:
+                        # The match may have been deleted or archived since the index synced
+                        found = get_incidents([duplicate[0]], columns=("description", "date"))
+                    if found:
+                        st.session_state.duplicate_ack = report_key
+                        dup_id, score = duplicate
+                        dup_description, dup_date = found[0]
+                        st.warning(f"⚠️ Possible duplicate of incident #{dup_id} filed {(dup_date or '')[:16]} ({score:.0%} similar):"
+                                   f" \"{dup_description}\". Press Submit Report again to file it anyway.")
+                    else:
+                        # Evidence goes to the content-addressed store before the DB write,
+                        # so the write lock is never held during file I/O
+                        blob = file_storage.store_blob(up_file) if up_file else None
+
+                        with transaction():
+                            incident_id = insert_incident((
+                                terminal,
+                                incident_type,
+                                severity,
+                                description,
+                                action_taken,
+                                str(datetime.datetime.now()),
+                                blob["path"] if blob else None
+                            ))
+                            if blob:
+                                file_storage.record_evidence(blob, up_file.name, terminal, incident_id)
+                        if blob:
+                            thumbnails.schedule(blob["sha256"], blob["path"], blob["mime_type"])
+                            if blob["mime_type"] == "application/pdf":
+                                knowledge.schedule_indexing()   # its passages feed the Safety Advisor
+                        st.session_state.duplicate_ack = None
+
+                        st.success("✅ Report Synced to Command Center.")
+
+
+        # =====================================
+        # ADMIN PANEL
+        # =====================================
+        elif st.session_state.role == "Admin":
+            metrics.section("admin.sync")
+            st.subheader("📊 Intelligent FRACAS")
+            # Per-session incident store: only rows changed since the last sync are fetched
+            if "incident_store" not in st.session_state:
+                st.session_state.incident_store = dashboard.IncidentStore()
+            store = st.session_state.incident_store
+            store.sync()
+            incidents = store.incidents()
+
+            if auto_poll:
+                @st.fragment(run_every=poll_every)
+                def poll_incidents():
+                    if store.sync():
+                        st.rerun()
+                poll_incidents()
+
+            if incidents:
+                # --- 1. KPI METRICS (read from the trigger-maintained rollups) ---
+                metrics.section("admin.kpis")
+                kpi = dashboard.kpis()
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Total Logs", kpi["total"])
+                m2.metric("Critical Alerts", kpi["critical"])
+                m3.metric("Safety Score", f"{kpi['score']}%")
+
+                # Export is streamed from SQLite only when the button is clicked,
+                # scoped to the feed's terminal filter from the previous run
+                export_fmt = m4.selectbox("Export format", list(export.FORMATS), label_visibility="collapsed")
+                export_scope = st.session_state.get("feed_terminal", "Show All Terminals")
+                export_filters = {} if export_scope == "Show All Terminals" else {"terminal": export_scope}
+                ext, mime = export.FORMATS[export_fmt]
+                m4.download_button(f"📥 Export {export_fmt}", data=functools.partial(export.export_buffer, export_fmt, **export_filters), file_name=f'KMRL_Audit_{datetime.date.today()}.{ext}', mime=mime)
+
+                st.markdown("---")
             
-            # --- 2. INTERACTIVE ANALYTICS ---
-            st.write("### 📈 Visual Risk Analytics")
-            g_col1, g_col2 = st.columns(2)
-            with g_col1:
-                t_data = df["Terminal"].value_counts().reset_index()
-                t_data.columns = ["Terminal", "Count"]
-                fig_t = px.bar(t_data, x="Terminal", y="Count", title="Incidents by Terminal", color_discrete_sequence=['#a2ffff'], template="plotly_dark")
-                fig_t.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-                st.plotly_chart(fig_t, use_container_width=True)
+                # --- 2. INTERACTIVE ANALYTICS ---
+                metrics.section("admin.analytics")
+                st.write("### 📈 Visual Risk Analytics")
+                g_col1, g_col2 = st.columns(2)
+                with g_col1:
+                    st.plotly_chart(dashboard.terminal_figure(), use_container_width=True)
             
-            with g_col2:
-                s_data = df["Severity"].value_counts().reset_index()
-                s_data.columns = ["Severity", "Count"]
-                c_map = {"Critical": "#ff4d4d", "High": "#ffa31a", "Medium": "#33ccff", "Low": "#70db70"}
-                fig_s = px.pie(s_data, values="Count", names="Severity", title="Risk Distribution", hole=0.5, color="Severity", color_discrete_map=c_map, template="plotly_dark")
-                fig_s.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-                st.plotly_chart(fig_s, use_container_width=True)
-
-            st.markdown("---")
-
-            # --- 3. FILTERED FEED ---
-            terminal_filter = st.selectbox("Filter Feed by Location", ["Show All Terminals"] + list(df["Terminal"].unique()))
-            display_df = df if terminal_filter == "Show All Terminals" else df[df["Terminal"] == terminal_filter]
-
-            for _, row in display_df.iterrows():
-                sev_color = {"Critical": "#ff4d4d", "High": "#ffa31a", "Medium": "#33ccff", "Low": "#70db70"}.get(row["Severity"], "white")
-                card_html = f"""
-<div class="incident-card">
-<h3 style="margin:0; color: #a2ffff !important;">🏢 {row['Terminal']}</h3>
-<p style="margin:5px 0; font-size: 0.9em;">
-<b>TYPE:</b> {row['Incident Type']} | <b>SEVERITY:</b> <span style="color:{sev_color}; font-weight:bold;">{row['Severity'].upper()}</span> | <b>DATE:</b> {row['Date'][:10]}
-</p>
-<p style="opacity: 0.9; margin-top:10px;">{row['Description']}</p>
-<div style="margin-top:10px; padding-top:10px; border-top: 1px solid rgba(255,255,255,0.1); font-size: 0.85em;">
-<b>RESPONSE:</b> {row['Action Taken']}
-</div>
-</div>"""
-                st.markdown(card_html, unsafe_allow_html=True)
-                # VIEW UPLOADED EVIDENCE
-
-                # if row['Evidence'] and os.path.exists(row['Evidence']):
-                #     with st.expander("👁️ View Evidence"):
-                #         if row['Evidence'].lower().endswith(('.png', '.jpg', '.jpeg')):
-                #             st.image(row['Evidence'], use_container_width=True)
-                #         else:
-                #             with open(row['Evidence'], "rb") as f:
-                #                 st.download_button("📥 Download PDF", f, file_name=os.path.basename(row['Evidence']), key=f"feed_dl_{row['ID']}")
-                # st.write("")
-                # --- 4. Global Evidence Vault (OUTSIDE THE LOOP) ---
-            # --- 4. Terminal-Based Evidence Explorer ---
-            st.markdown("---")
-            st.write("### 📁 Evidence Explorer (By Terminal)")
-
-            if os.path.exists(UPLOAD_DIR):
-
-                terminal_folders = [
-                    folder for folder in os.listdir(UPLOAD_DIR)
-                    if os.path.isdir(os.path.join(UPLOAD_DIR, folder))
-                ]
+                with g_col2:
+                    st.plotly_chart(dashboard.severity_figure(), use_container_width=True)
+
+                st.plotly_chart(dashboard.trend_figure(), use_container_width=True)
+
+                # Risk and anomaly scoring reads every live incident, so it only
+                # runs when asked for; the charts above come from the rollups
+                if st.toggle("🎯 Show risk & anomaly analysis", key="show_risk_analysis"):
+                    stats = dashboard.incident_analytics()
+                    r_col1, r_col2 = st.columns(2)
+                    with r_col1:
+                        st.write("#### 🎯 Severity-Weighted Risk")
+                        st.dataframe(stats["risk"], hide_index=True, use_container_width=True,
+                                     column_config={"Risk Share": st.column_config.NumberColumn(format="percent"),
+                                                    "Recent Rate": st.column_config.NumberColumn(format="%.2f"),
+                                                    "Baseline Rate": st.column_config.NumberColumn(format="%.2f"),
+                                                    "Trend": st.column_config.NumberColumn(format="%.2fx")})
+                    with r_col2:
+                        st.write("#### 🚨 Anomalies (Latest Week)")
+                        flagged = stats["anomalies"][stats["anomalies"]["Flagged"]]
+                        if flagged.empty:
+                            st.caption("No terminal/type pair is far above its own history.")
+                        else:
+                            st.dataframe(flagged.drop(columns="Flagged"), hide_index=True, use_container_width=True)
+
+                st.markdown("---")
+
+                # --- 3. FILTERED FEED ---
+                metrics.section("admin.feed")
+                terminal_filter = st.selectbox("Filter Feed by Location", ["Show All Terminals"] + dashboard.terminals(), key="feed_terminal")
+                feed_filters = {} if terminal_filter == "Show All Terminals" else {"terminal": terminal_filter}
+
+                search_text = st.text_input("🔍 Search descriptions and responses", key="feed_search",
+                                            placeholder='e.g. gangway, "life jacket", corro*').strip()
+                if search_text:
+                    incident_feed.render_search(search_text, feed_filters, version=store.version)
+                else:
+                    incident_feed.render_feed(feed_filters, version=store.version)
+
+                # --- 4. Terminal-Based Evidence Explorer ---
+                metrics.section("admin.evidence")
+                st.markdown("---")
+                st.write("### 📁 Evidence Explorer (By Terminal)")
+
+                # Folders and files come from the evidence index, not the filesystem
+                terminal_folders = file_storage.get_terminal_folders()
 
                 if terminal_folders:
 
@@ -325,64 +367,212 @@ else:
                         key="terminal_folder_selector"
                     )
 
-                    terminal_path = os.path.join(UPLOAD_DIR, selected_terminal)
+                    # Keyset pages of index rows; bytes are only read when a
+                    # download is clicked or a preview is opened
+                    if st.session_state.get("explorer_terminal") != selected_terminal:
+                        st.session_state.explorer_terminal = selected_terminal
+                        st.session_state.explorer_cursors = [None]
+                        st.session_state.explorer_preview = None
+                    explorer_cursors = st.session_state.explorer_cursors
 
-                    files = [
-                        f for f in os.listdir(terminal_path)
-                        if os.path.isfile(os.path.join(terminal_path, f))
-                    ]
+                    files = file_storage.list_evidence(terminal=selected_terminal, before_id=explorer_cursors[-1], limit=EXPLORER_PAGE_SIZE)
+                    st.caption(f"{file_storage.count_evidence(selected_terminal)} documents")
 
                     if files:
-                        for file_name in files:
-                            file_path = os.path.join(terminal_path, file_name)
-
-                            with open(file_path, "rb") as f:
-                                st.download_button(
-                                    label=f"📥 Download {file_name}",
-                                    data=f,
-                                    file_name=file_name,
-                                    key=f"{selected_terminal}_{file_name}"
-                                )
+                        rows = [dict(zip(file_storage.EVIDENCE_KEYS, row)) for row in files]
+                        thumbs = thumbnails.thumbnail_paths((ev["sha256"], ev["path"], ev["mime_type"]) for ev in rows)
+                        for ev in rows:
+                            thumb_col, info_col, preview_col, dl_col = st.columns([1, 4, 1, 1])
+                            try:
+                                with open(thumbs[ev["sha256"]], "rb") as thumb:
+                                    thumb_col.image(thumb.read(), width=80)
+                            except (KeyError, OSError):
+                                thumb_col.markdown("📄")   # not rendered yet, no preview, or evicted meanwhile
+                            incident_note = f" · Incident #{ev['incident_id']} ({ev['incident_type']}, {ev['severity']})" if ev["incident_id"] else ""
+                            info_col.markdown(f"**{ev['file_name']}**  \n{file_storage.human_size(ev['size'])} · {(ev['uploaded_at'] or '')[:16]}{incident_note}")
+                            if not os.path.exists(ev["path"]):
+                                dl_col.caption("⚠️ File missing")
+                                continue
+                            if ev["mime_type"].startswith("image/") and preview_col.button("👁️ Preview", key=f"preview_{ev['id']}"):
+                                st.session_state.explorer_preview = ev["id"]
+                            dl_col.download_button(
+                                label="📥 Download",
+                                data=functools.partial(file_storage.read_evidence, ev["id"]),
+                                file_name=ev["file_name"],
+                                mime=ev["mime_type"],
+                                key=f"evidence_{ev['id']}"
+                            )
+
+                        preview_id = st.session_state.explorer_preview
+                        if preview_id:
+                            with st.expander("👁️ Evidence Preview", expanded=True):
+                                try:
+                                    st.image(file_storage.read_evidence(preview_id), use_container_width=True)
+                                except FileNotFoundError:
+                                    st.warning("This file is no longer on disk.")
+
+                        newer_col, _, older_col = st.columns([1, 4, 1])
+                        if len(explorer_cursors) > 1 and newer_col.button("⬅️ Newer", key="explorer_newer"):
+                            explorer_cursors.pop()
+                            st.rerun()
+                        if len(files) == EXPLORER_PAGE_SIZE and older_col.button("Older ➡️", key="explorer_older"):
+                            explorer_cursors.append(files[-1][0])
+                            st.rerun()
                     else:
                         st.info("No documents in this terminal folder yet.")
 
                 else:
-                    st.info("No terminal folders found.")
+                    st.info("No files uploaded yet.")
 
-            else:
-                st.info("No files uploaded yet.")
 
-
-            # --- 4. FLOATING CHATBOT ICON ---
-            # The div wrapper is no longer strictly needed because CSS targets stPopover directly
-            with st.popover("💬"):
-                st.markdown("### 💬 Safety Advisor")
-                st.caption("General Work Site Safety & Security Assistant")
+                # --- 4. FLOATING CHATBOT ICON ---
+                # The div wrapper is no longer strictly needed because CSS targets stPopover directly
+                metrics.section("admin.chat")
+                with st.popover("💬"):
+                    st.markdown("### 💬 Safety Advisor")
+                    st.caption("General Work Site Safety & Security Assistant")
                 
-                if "messages" not in st.session_state:
-                    st.session_state.messages = []
-
-                for message in st.session_state.messages:
-                    with st.chat_message(message["role"]):
-                        st.markdown(message["content"])
-
-                if prompt := st.chat_input("Ask a safety question..."):
-                    st.session_state.messages.append({"role": "user", "content": prompt})
-                    with st.chat_message("user"):
-                        st.markdown(prompt)
-
-                    with st.chat_message("assistant"):
-                        with st.spinner("Thinking..."):
-                            response = get_safety_chatbot_response(prompt)
-                            st.markdown(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-
-            # AI Audit Button
-            st.markdown("---")
-            if st.button("🤖 Run Advanced AI Fleet Audit"):
-                with st.spinner("Processing safety data..."):
-                    result = analyze_incidents(incidents)
-                st.info(result)
-
-        else:
-            st.info("No safety logs found in the database.")
\ No newline at end of file
+                    if "messages" not in st.session_state:
+                        st.session_state.messages = []
+
+                    for message in st.session_state.messages:
+                        with st.chat_message(message["role"]):
+                            st.markdown(message["content"])
+
+                    if prompt := st.chat_input("Ask a safety question..."):
+                        st.session_state.messages.append({"role": "user", "content": prompt})
+                        with st.chat_message("user"):
+                            st.markdown(prompt)
+
+                        with st.chat_message("assistant"):
+                            # Rendered token by token as the model streams its answer
+                            response = st.write_stream(stream_safety_chatbot_response(prompt))
+                        st.session_state.messages.append({"role": "assistant", "content": response})
+
+                # AI Audit Button
+                metrics.section("admin.audit")
+                st.markdown("---")
+                audit_col, refresh_col = st.columns([3, 1])
+                force_refresh = refresh_col.checkbox("Ignore cached report")
+                if audit_col.button("🤖 Run Advanced AI Fleet Audit"):
+                    # Runs on the background job runner; an identical audit already
+                    # in flight (e.g. another admin's click) is joined, not repeated
+                    st.session_state.audit_job = submit_audit(incidents, use_cache=not force_refresh, version=store.version)
+
+                audit_job = st.session_state.get("audit_job")
+                if audit_job:
+                    job = jobs.get_job(audit_job)
+                    running = job is not None and job["status"] in ("queued", "running")
+
+                    @st.fragment(run_every=AUDIT_POLL_SECONDS if running else None)
+                    def audit_status():
+                        job = jobs.get_job(audit_job)
+                        if job is None:
+                            return
+                        if job["status"] in ("queued", "running"):
+                            st.progress(job["progress"], text=job["message"] or "Processing safety data...")
+                            return
+                        if running:
+                            st.rerun()   # finished since the last full run: stop polling
+                        if job["status"] == "failed":
+                            st.error(f"Audit failed: {job['error']}")
+                            return
+                        audit = job["result"]
+                        if audit["fallback"]:
+                            st.warning("Groq API failed. Providing local summary instead.")
+                        if audit["cached_at"]:
+                            age_min = int((time.time() - audit["cached_at"]) // 60)
+                            st.caption(f"♻️ Cached report from {age_min // 60}h {age_min % 60}m ago — the incident data has not changed since.")
+                        elif audit["chunks"]:
+                            st.caption(f"🧩 Audited in {audit['chunks']} chunks ({audit['chunks_cached']} summaries reused from cache).")
+                        st.info(audit["report"])
+
+                    audit_status()
+
+            else:
+                st.info("No safety logs found in the database.")
+
+            # --- 5. ARCHIVE (incidents past the horizon live in per-year files) ---
+            metrics.section("admin.archive")
+            archive_job = archive.schedule() or st.session_state.get("archive_job")
+            with st.expander("🗄️ Archive"):
+                info = archive.status()
+                if archive.ARCHIVE_AFTER_DAYS > 0:
+                    st.caption(f"Incidents dated more than {archive.ARCHIVE_AFTER_DAYS} days ago are moved to one archive file per year automatically.")
+                else:
+                    st.caption("Archive now moves incidents older than the days below to one archive file per year.")
+                st.caption(f"Archived incidents leave the feed, search and risk analysis, which cover the live database "
+                           f"({info['hot_bytes'] / 1e6:.1f} MB); the totals and charts above include every year.")
+                if info["partitions"]:
+                    st.dataframe([
+                        {"Year": p["year"], "Incidents": p["rows"], "Size (MB)": round(p["bytes"] / 1e6, 1),
+                         "Compacted": bool(p["compacted_at"] and p["compacted_at"] >= p["archived_at"])}
+                        for p in info["partitions"]
+                    ], hide_index=True, use_container_width=True)
+                    y_col, x_col = st.columns([1, 1])
+                    year = y_col.selectbox("Archived year", [p["year"] for p in reversed(info["partitions"])], label_visibility="collapsed")
+                    # The date range is what makes the export read that year's file
+                    x_col.download_button(f"📥 Export {year} (CSV)", file_name=f"KMRL_Audit_{year}.csv", mime="text/csv",
+                                          data=functools.partial(export.export_buffer, "CSV", date_from=f"{year}-01-01", date_to=f"{year + 1}-01-01"))
+                d_col, a_col, c_col = st.columns(3)
+                archive_days = d_col.number_input("Archive incidents older than (days)", min_value=30, step=30,
+                                                  value=archive.ARCHIVE_AFTER_DAYS or archive.MANUAL_ARCHIVE_DAYS)
+                if a_col.button("Archive now"):
+                    archive_job = jobs.submit("archive", "run", archive.run, int(archive_days))
+                if c_col.button("Compact storage"):
+                    archive_job = jobs.submit("archive", "compact", archive.compact)
+                if archive_job:
+                    st.session_state.archive_job = archive_job
+                    job = jobs.get_job(archive_job)
+                    running = job is not None and job["status"] in ("queued", "running")
+
+                    @st.fragment(run_every=AUDIT_POLL_SECONDS if running else None)
+                    def archive_status():
+                        job = jobs.get_job(archive_job)
+                        if job is None:
+                            return
+                        if job["status"] in ("queued", "running"):
+                            st.progress(job["progress"], text=job["message"] or "Working on the archive...")
+                            return
+                        if running:
+                            st.rerun()   # finished since the last full run: refresh the table above
+                        if job["status"] == "failed":
+                            st.error(f"Archive job failed: {job['error']}")
+                        elif job["key"] == "run":
+                            st.caption(f"Last run archived {job['result']['moved']:,} incidents.")
+                        else:
+                            st.caption(f"Storage compacted; {job['result']['hot_bytes_freed'] / 1e6:.1f} MB freed.")
+
+                    archive_status()
+
+            # --- 6. PERFORMANCE DIAGNOSTICS (what this process recorded since start) ---
+            if metrics.ENABLED:
+                metrics.section("admin.diagnostics")
+                with st.expander("🩺 Performance diagnostics"):
+                    snap = metrics.snapshot()
+                    st.write("#### ⏱️ Spans")
+                    st.dataframe([
+                        {"Span": name, "Calls": s["count"], "Errors": s["errors"],
+                         **{label: round(s[key] * 1000, 2) for label, key in
+                            (("p50 ms", "p50_s"), ("p90 ms", "p90_s"), ("p99 ms", "p99_s"), ("Max ms", "max_s"))}}
+                        for name, s in sorted(snap["spans"].items())
+                    ], hide_index=True, use_container_width=True)
+                    st.write("#### 🔢 Counters")
+                    st.dataframe([{"Counter": name, "Total": value} for name, value in sorted(snap["counters"].items())],
+                                 hide_index=True, use_container_width=True)
+                    st.write("#### 🔁 Recent Reruns")
+                    st.dataframe([
+                        {"Started": datetime.datetime.fromtimestamp(run["started"]).strftime("%H:%M:%S"),
+                         "Page": run["label"], "Complete": run["complete"], "Total ms": round(run["seconds"] * 1000, 1),
+                         "Statements": run["counters"].get("db.statements", 0), "Rows": run["counters"].get("db.rows", 0),
+                         **{name: round(seconds * 1000, 1) for name, seconds in run["spans"].items()
+                            if name.startswith(("admin.", "officer."))}}
+                        for run in reversed(metrics.recent_runs())
+                    ], hide_index=True, use_container_width=True)
+                    d1, d2, d3 = st.columns(3)
+                    d1.download_button("📥 Prometheus text", data=metrics.prometheus_text, file_name="safety_metrics.prom", mime="text/plain")
+                    d2.download_button("📥 Runs (JSONL)", data=metrics.runs_jsonl, file_name="safety_runs.jsonl", mime="application/x-ndjson")
+                    if d3.button("Reset metrics"):
+                        metrics.reset()
+                        st.rerun()
+
@@ -0,0 +1,199 @@
+import datetime
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import database
+import jobs
+from database import (
+    archive_batch, archive_partitions, connection, migrate, partition_path, prune_tombstones, transaction,
+    year_start,
+)
+
+# Hot/cold archival. Incidents dated more than a given number of days ago
+# move to per-year partition files (see ARCHIVE PARTITIONS in database.py),
+# ARCHIVE_BATCH rows per transaction, so the report form never waits long on
+# the write lock. compact() then gives the space back: it prunes the
+# tombstones the moves left, merges the search index and VACUUMs the hot file
+# once enough of it is free. Each partition is VACUUMed and ANALYZEd once
+# after the run that wrote to it; nothing touches it again until the next.
+#
+# Archived incidents leave the feed, search and charts, so archiving is
+# opt-in: runs start from the admin page or the CLI unless
+# SAFETY_ARCHIVE_AFTER_DAYS is set, which makes schedule() keep the live
+# database to that many days.
+ARCHIVE_AFTER_DAYS = int(os.environ.get("SAFETY_ARCHIVE_AFTER_DAYS", "0"))   # 0: only archived by hand
+MANUAL_ARCHIVE_DAYS = 365       # suggested horizon for a run started by hand
+COMPACT_FREE_FRACTION = 0.2     # the hot file is VACUUMed when this share of its pages is free
+CHECK_INTERVAL_S = 60 * 60      # how often schedule() looks for incidents past the horizon
+
+_last_check = float("-inf")
+
+
+def horizon(days=ARCHIVE_AFTER_DAYS):
+    """Epoch seconds; incidents dated before this are archived."""
+    return time.time() - days * 86400
+
+
+def _year(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).year
+
+
+def _oldest_before(conn, since, before):
+    return conn.execute("SELECT MIN(ts) FROM incidents WHERE ts >= ? AND ts < ?", (since, before)).fetchone()[0]
+
+
+def archive_incidents(days=ARCHIVE_AFTER_DAYS, progress=None):
+    """Moves every incident dated before the horizon to its year's partition.
+
+    Returns {"moved", "years"}: how many incidents moved and into which years.
+    """
+    stats = {"moved": 0, "years": []}
+    if days <= 0:
+        return stats
+    before = horizon(days)
+    with connection() as conn:
+        oldest = _oldest_before(conn, float("-inf"), before)
+    if oldest is None:
+        return stats
+    first, last = _year(oldest), _year(before)
+    year = first
+    while year is not None:
+        moved = 0
+        while True:
+            if progress:
+                progress((year - first) / (last - first + 1), f"Archiving {year}: {moved:,} incidents moved")
+            batch = archive_batch(year, before)
+            moved += batch
+            if batch < database.ARCHIVE_BATCH:
+                break
+        if moved:
+            stats["moved"] += moved
+            stats["years"].append(year)
+        # Skip straight to the next year that has anything to move
+        with connection() as conn:
+            oldest = _oldest_before(conn, year_start(year + 1), before)
+        year = None if oldest is None else _year(oldest)
+    return stats
+
+
+def _pages(conn):
+    return conn.execute("PRAGMA page_count").fetchone()[0], conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def compact(progress=None):
+    """Reclaims the space archiving leaves behind in the hot file and partitions.
+
+    Returns {"tombstones", "hot_vacuumed", "hot_bytes_freed", "partitions"}:
+    tombstones pruned, whether the hot file was VACUUMed and how much it
+    shrank, and the years whose partition was compacted.
+    """
+    if progress:
+        progress(0.0, "Pruning tombstones")
+    stats = {"tombstones": prune_tombstones(), "hot_vacuumed": False, "hot_bytes_freed": 0, "partitions": []}
+    with transaction() as conn:
+        # Deletes leave the search index's b-trees fragmented; this merges them
+        conn.execute("INSERT INTO incidents_fts (incidents_fts) VALUES ('optimize')")
+
+    with connection() as conn:
+        pages, free = _pages(conn)
+        if pages and free / pages >= COMPACT_FREE_FRACTION:
+            if progress:
+                progress(0.1, "Compacting the live database")
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            conn.execute("VACUUM")
+            stats["hot_vacuumed"] = True
+            stats["hot_bytes_freed"] = (pages - _pages(conn)[0]) * page_size
+        # In WAL mode the file only shrinks once the log is written back
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    stale = [year for year, _, archived_at, compacted_at in archive_partitions()
+             if compacted_at is None or compacted_at < archived_at]
+    for i, year in enumerate(stale):
+        if progress:
+            progress(0.2 + 0.8 * i / len(stale), f"Compacting the {year} archive")
+        with closing(sqlite3.connect(partition_path(year))) as partition:
+            partition.execute("VACUUM")
+            partition.execute("ANALYZE")
+            partition.commit()
+        with transaction() as conn:
+            conn.execute("UPDATE archive_partitions SET compacted_at = ? WHERE year = ?", (time.time(), year))
+        stats["partitions"].append(year)
+    return stats
+
+
+def run(days=ARCHIVE_AFTER_DAYS, progress=None):
+    """archive_incidents(), then compact() if anything moved."""
+    stats = archive_incidents(days, progress)
+    if stats["moved"]:
+        stats.update(compact(progress))
+    return stats
+
+
+def schedule(days=ARCHIVE_AFTER_DAYS):
+    """Starts a background archive run when incidents are past the horizon;
+    returns the job id or None.
+
+    Looks at most once per CHECK_INTERVAL_S in a process, so it is cheap to
+    call on every rerun.
+    """
+    global _last_check
+    if days <= 0 or time.monotonic() - _last_check < CHECK_INTERVAL_S:
+        return None
+    _last_check = time.monotonic()
+    with connection() as conn:
+        if not conn.execute("SELECT 1 FROM incidents WHERE ts < ? LIMIT 1", (horizon(days),)).fetchone():
+            return None
+    return jobs.submit("archive", "run", run, days)
+
+
+def status():
+    """{"hot_bytes", "partitions"}; each partition a dict of year, rows,
+    bytes, archived_at and compacted_at."""
+    with connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        hot_bytes = (_pages(conn)[0]) * page_size
+    partitions = []
+    for year, rows, archived_at, compacted_at in archive_partitions():
+        path = partition_path(year)
+        partitions.append({
+            "year": year, "rows": rows, "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+            "archived_at": archived_at, "compacted_at": compacted_at,
+        })
+    return {"hot_bytes": hot_bytes, "partitions": partitions}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive old incidents into per-year partition files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="archive incidents past the horizon, then compact")
+    days = ARCHIVE_AFTER_DAYS or MANUAL_ARCHIVE_DAYS
+    run_parser.add_argument("--days", type=int, default=days,
+                            help=f"archive incidents dated more than this many days ago (default {days})")
+    commands.add_parser("compact", help="prune tombstones and VACUUM the hot file and changed partitions")
+    commands.add_parser("status", help="show the hot file and partition sizes")
+    args = parser.parse_args(argv)
+
+    migrate()
+    if args.command == "run":
+        stats = run(args.days, progress=lambda fraction, message=None: print(message))
+        print(f"Archived {stats['moved']:,} incidents into {len(stats['years'])} partitions.")
+        if stats["moved"]:
+            print(f"Pruned {stats['tombstones']:,} tombstones; freed {stats['hot_bytes_freed'] / 1e6:.1f} MB.")
+    elif args.command == "compact":
+        stats = compact()
+        print(f"Pruned {stats['tombstones']:,} tombstones; freed {stats['hot_bytes_freed'] / 1e6:.1f} MB;"
+              f" compacted {len(stats['partitions'])} partitions.")
+    elif args.command == "status":
+        info = status()
+        print(f"live database: {info['hot_bytes'] / 1e6:.1f} MB")
+        for p in info["partitions"]:
+            print(f"{p['year']}: {p['rows']:,} incidents, {p['bytes'] / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,22 +1,14 @@
-import sqlite3
-from database import DB_NAME
+from database import connection
 
-def create_default_users():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-
-    c.execute("INSERT OR IGNORE INTO users VALUES ('admin', 'admin123', 'Admin')")
-    c.execute("INSERT OR IGNORE INTO users VALUES ('officer', 'officer123', 'Officer')")
-
-    conn.commit()
-    conn.close()
+def seed_default_users(conn):
+    """Schema migration step: the built-in admin and officer accounts."""
+    conn.execute("INSERT OR IGNORE INTO users VALUES ('admin', 'admin123', 'Admin')")
+    conn.execute("INSERT OR IGNORE INTO users VALUES ('officer', 'officer123', 'Officer')")
 
 def login(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-
-    c.execute("SELECT role FROM users WHERE username=? AND password=?", (username, password))
-    user = c.fetchone()
-    conn.close()
+    with connection() as conn:
+        user = conn.execute(
+            "SELECT role FROM users WHERE username=? AND password=?", (username, password)
+        ).fetchone()
 
     return user[0] if user else None
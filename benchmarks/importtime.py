@@ -0,0 +1,105 @@
+"""Import-time report for the modules on the login and Officer paths.
+
+Runs ``python -X importtime -c "import <module>"`` in a fresh interpreter
+per module and summarises the output. Streamlit is imported first in every
+run, so the numbers show what each module adds on top of it. The run fails
+(exit code 1) when a login-path module pulls in a heavy dependency that
+should only load on the Admin analytics or AI code paths.
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --top 15 --json importtime.json
+"""
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported by app.py before the login form is drawn
+LOGIN_PATH_MODULES = (
+    "database", "auth", "archive", "ai_cache", "jobs", "file_storage", "thumbnails",
+    "export", "dashboard", "incident_feed", "knowledge", "ai_analysis",
+)
+# Only the Admin analytics and AI paths (and a submitted report's duplicate
+# check) may load these
+HEAVY_MODULES = ("pandas", "numpy", "plotly.express", "openai", "pyarrow", "pypdfium2", "analytics", "similarity")
+BASELINE = "streamlit"
+
+
+def parse_importtime(stderr):
+    """[(name, depth, self_us, cumulative_us)] from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure(module, baseline=BASELINE):
+    """Import cost of module in a fresh interpreter, after the baseline import."""
+    code = f"import {baseline}; import {module}" if baseline else f"import {module}"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    entries = parse_importtime(proc.stderr)
+    before = set()
+    if baseline:
+        # Entries are printed as each import finishes, so the baseline's
+        # modules are exactly those up to and including its top-level line
+        for i, (name, depth, _, _) in enumerate(entries):
+            if depth == 0 and name == baseline:
+                before = {e[0] for e in entries[:i + 1]}
+                entries = entries[i + 1:]
+                break
+    loaded = {e[0] for e in entries}
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+        "total_ms": sum(e[3] for e in entries if e[1] == 0) / 1000,
+        "modules_loaded": len(loaded),
+        "heavy": sorted(m for m in HEAVY_MODULES if m in loaded and m not in before),
+        "slowest": sorted(((e[0], e[3] / 1000) for e in entries if e[1] <= 1), key=lambda x: -x[1]),
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report module import times")
+    parser.add_argument("modules", nargs="*", default=list(LOGIN_PATH_MODULES))
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per module")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--no-baseline", action="store_true", help=f"do not import {BASELINE} first")
+    args = parser.parse_args(argv)
+
+    baseline = None if args.no_baseline else BASELINE
+    report = [measure(module, baseline) for module in args.modules]
+
+    print(f"{'module':<16}{'ms':>9}{'modules':>9}  heavy dependencies")
+    for r in report:
+        if not r["ok"]:
+            print(f"{r['module']:<16}{'failed':>9}  {r['error']}")
+            continue
+        print(f"{r['module']:<16}{r['total_ms']:>9.1f}{r['modules_loaded']:>9}  {', '.join(r['heavy']) or '-'}")
+        for name, ms in r["slowest"][:args.top]:
+            print(f"    {name:<40}{ms:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"baseline": baseline, "modules": report}, f, indent=2)
+
+    failed = [r["module"] for r in report if not r["ok"] or (r["module"] in LOGIN_PATH_MODULES and r["heavy"])]
+    if failed:
+        print(f"\nRegression: heavy imports on the login path in {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,255 @@
+"""Benchmark suite for the database, analytics, AI-prompt and dashboard paths.
+
+Each size gets a seeded synthetic database (see synthetic.py), built once
+into benchmarks/data/ and copied to a scratch file per run, because some
+cases write. LLM calls go to the local stub in llm_stub.py, never to a real
+endpoint. Results are written as JSON; pass an earlier file as --compare to
+flag regressions (the exit code is 1 when there are any).
+
+    python -m benchmarks.run --sizes 10000 100000 --out before.json
+    python -m benchmarks.run --sizes 10000 100000 --compare before.json
+"""
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+import ai_analysis
+import ai_cache
+import auth
+import dashboard
+import database
+import export
+import jobs
+import llm_stub
+from benchmarks import importtime, synthetic
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_REPEAT = 3
+INSERT_SAMPLE = 200                 # insert_incident calls per timed run
+LOGIN_SAMPLE = 1000
+SEARCH_TERMS = ("gangway", '"oil spill"', "battery overheating")
+REGRESSION_THRESHOLD = 0.25         # slower than baseline by this fraction ...
+REGRESSION_MIN_DELTA_S = 0.005      # ... and by at least this much, to ignore timer noise
+
+
+class _Discard(io.RawIOBase):
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return len(b)
+
+
+def timed(fn, repeat, setup=None, ops=1):
+    """Runs setup() then fn() repeat times; per-run seconds plus summary."""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    result = {"runs": runs, "median_s": statistics.median(runs), "min_s": min(runs)}
+    if ops > 1:
+        result["per_op_s"] = result["median_s"] / ops
+    return result
+
+
+def _fresh_dashboard():
+    dashboard._cache.clear()
+
+
+def _clear_ai_cache():
+    ai_cache.clear("audit")
+    ai_cache.clear("audit_chunk")
+
+
+def cases(rows, repeat, stub_ok):
+    """(name, fn, options) for one database; rows is get_all_incidents() output."""
+    def insert_batch():
+        for row in synthetic.incidents(INSERT_SAMPLE, seed=len(rows)):
+            database.insert_incident(row)
+
+    def login_batch():
+        for i in range(LOGIN_SAMPLE):
+            auth.login("admin" if i % 2 else "officer", "admin123" if i % 2 else "officer123")
+
+    def audit_prompt():
+        ai_analysis.format_incidents(rows)
+        ai_analysis.chunk_incidents(rows)
+
+    def dashboard_aggregates():
+        dashboard.kpis()
+        dashboard.terminals()
+        dashboard.terminal_figure()
+        dashboard.severity_figure()
+
+    def dashboard_analytics():
+        dashboard.incident_analytics()
+        dashboard.trend_figure()
+
+    def search():
+        for term in SEARCH_TERMS:
+            database.count_search(term)
+            database.search_incidents(term)
+
+    yield "get_all_incidents", database.get_all_incidents, {}
+    yield "login", login_batch, {"ops": LOGIN_SAMPLE}
+    yield "local_analysis", lambda: ai_analysis.local_analysis(rows), {}
+    yield "audit_prompt", audit_prompt, {}
+    if stub_ok:
+        # Cold: every chunk summary is requested from the stub; warm: all
+        # come from the chunk cache and only the final report is requested
+        yield "audit_stub_cold", lambda: ai_analysis.run_audit(rows, use_cache=False), {
+            "setup": _clear_ai_cache, "repeat": 1}
+        yield "audit_stub_warm", lambda: ai_analysis.run_audit(rows, use_cache=False), {"repeat": 1}
+    yield "dashboard_aggregates", dashboard_aggregates, {"setup": _fresh_dashboard}
+    yield "dashboard_analytics", dashboard_analytics, {"setup": _fresh_dashboard}
+    yield "incident_store_sync", lambda: dashboard.IncidentStore().sync(), {}
+    yield "export_csv", lambda: export.write_csv(_Discard()), {}
+    yield "search", search, {"ops": len(SEARCH_TERMS)}
+    # Last: it adds rows to the scratch database
+    yield "insert_incident", insert_batch, {"ops": INSERT_SAMPLE}
+
+
+def run_size(n, seed, repeat, rebuild, stub_ok, log, only=None):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    cached = os.path.join(DATA_DIR, f"synthetic-{n}-{seed}.db")
+    if rebuild or not os.path.exists(cached):
+        log(f"building {cached}")
+        synthetic.build_db(cached, n, seed)
+        database.get_pool(cached).close_all()
+    scratch = os.path.join(DATA_DIR, f"scratch-{n}.db")
+    shutil.copy(cached, scratch)
+    database.DB_NAME = scratch
+    database.migrate()
+    _fresh_dashboard()
+    try:
+        rows = database.get_all_incidents()
+        results = {}
+        for name, fn, options in cases(rows, repeat, stub_ok):
+            if only and name not in only:
+                continue
+            results[name] = timed(fn, options.get("repeat", repeat), options.get("setup"), options.get("ops", 1))
+            log(f"{n:>9,} {name:<22} {results[name]['median_s'] * 1000:>10.1f} ms")
+        return results
+    finally:
+        database.get_pool(scratch).close_all()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+
+
+def warm_imports():
+    """Imports the lazily loaded heavy modules up front, so their one-off
+    cost (measured by the import cases) does not land on the first case."""
+    import analytics  # noqa: F401
+    import openai  # noqa: F401
+    import plotly.express  # noqa: F401
+
+
+def start_stub():
+    """Points the AI module at a local stub; False if secrets override it."""
+    _, base_url = llm_stub.start()
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+    if ai_analysis.groq_base_url() != base_url:
+        return False
+    # Measure our own overhead, not the production request budget
+    ai_analysis._limiter = jobs.RateLimiter(rate_per_s=1e9, burst=1e9)
+    return True
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, min_delta=REGRESSION_MIN_DELTA_S):
+    """[(size, case, baseline_s, current_s)] for cases that got slower."""
+    regressions = []
+    for size, cases_now in results.items():
+        for name, now in cases_now.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            old, new = before["median_s"], now["median_s"]
+            if new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append((size, name, old, new))
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=importtime.REPO_ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the synthetic-load benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--seed", type=int, default=synthetic.DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--cases", nargs="+", metavar="CASE", help="run only these cases, e.g. search login")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the cached synthetic databases")
+    parser.add_argument("--no-importtime", action="store_true", help="skip the import-time cases")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    stub_ok = start_stub()
+    if not stub_ok:
+        log("GROQ_BASE_URL is set in Streamlit secrets; skipping the audit cases")
+
+    results = {}
+    if not args.no_importtime:
+        results["import"] = {}
+        for module in importtime.LOGIN_PATH_MODULES:
+            ms = [importtime.measure(module)["total_ms"] for _ in range(args.repeat)]
+            results["import"][module] = {"runs": [m / 1000 for m in ms], "median_s": statistics.median(ms) / 1000,
+                                         "min_s": min(ms) / 1000}
+        log(f"{'import':>9} {'login path total':<22} "
+            f"{sum(r['median_s'] for r in results['import'].values()) * 1000:>10.1f} ms")
+    warm_imports()
+    for n in args.sizes:
+        results[str(n)] = run_size(n, args.seed, args.repeat, args.rebuild, stub_ok, log, args.cases)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for size, name, old, new in regressions:
+            print(f"REGRESSION {size} {name}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({new / old - 1:+.0%})")
+        print(f"{len(regressions)} regressions against {args.compare}"
+              f" ({baseline['meta'].get('revision') or 'unknown revision'}).")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
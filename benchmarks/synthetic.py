@@ -0,0 +1,97 @@
+"""Seeded synthetic incident logs for the benchmarks.
+
+The same seed and size always give the same rows, so timings from
+different runs and machines are comparable. Values come from the sets the
+report form offers; terminals, categories and severities are skewed
+rather than uniform, and a few terminal/category pairs spike in the last
+week so the risk and anomaly code has real work to do.
+
+    python -m benchmarks.synthetic 100000 --out /tmp/incidents.jsonl
+"""
+import datetime
+import json
+import os
+import random
+
+import database
+import ingest
+from database import INCIDENT_TYPES, SEVERITIES, TERMINALS
+
+DEFAULT_SEED = 20240501
+START = datetime.datetime(2020, 1, 1)
+SPAN_DAYS = 5 * 365
+SEVERITY_WEIGHTS = (45, 30, 18, 7)          # Low .. Critical
+TYPE_WEIGHTS = (30, 25, 15, 20, 10)         # in INCIDENT_TYPES order
+SPIKE_PAIRS = 3                             # terminal/type pairs that jump in the final week
+SPIKE_FACTOR = 6
+
+PARTS = {
+    "Mechanical": ("gangway hinge", "mooring winch", "propulsion pod", "bow thruster", "ramp actuator", "steering linkage"),
+    "Electrical": ("charging connector", "battery pack", "shore power cable", "cabin lighting", "fire alarm panel", "inverter"),
+    "Injury": ("wet gangway", "boarding ramp", "stairway", "passenger deck", "mooring line", "ticket gate"),
+    "Security": ("turnstile", "CCTV camera", "crew door", "life jacket locker", "ticket counter", "parking bay"),
+    "Environmental": ("bilge discharge", "oil spill", "floating debris", "fuel odour", "noise level", "hull fouling"),
+}
+FINDINGS = ("reported faulty", "found damaged", "failed inspection", "overheating", "intermittent fault",
+            "slippery after rain", "left unattended", "leaking", "out of service", "making unusual noise")
+ACTIONS = ("Area cordoned off and maintenance notified.", "Crew replaced the part on site.",
+           "Passenger given first aid and incident logged.", "Security team informed and CCTV reviewed.",
+           "Service suspended until inspection is complete.", "Cleaned up and warning signs placed.",
+           "Escalated to the command center.", "Temporary fix applied; follow-up scheduled.")
+
+
+def incidents(n, seed=DEFAULT_SEED, start=START, span_days=SPAN_DAYS):
+    """Yields n (terminal, type, severity, description, action, date, evidence) tuples, oldest first."""
+    rng = random.Random(seed)
+    terminal_weights = [rng.uniform(0.3, 3.0) for _ in TERMINALS]
+    spikes = {(rng.choice(TERMINALS), rng.choice(INCIDENT_TYPES)) for _ in range(SPIKE_PAIRS)}
+    spike_from = n - max(1, n * 7 // span_days)      # rows falling in the last week
+    step = span_days * 86400 / max(n, 1)
+    for i in range(n):
+        if i >= spike_from and spikes and rng.random() < SPIKE_FACTOR / (SPIKE_FACTOR + len(TERMINALS)):
+            terminal, incident_type = rng.choice(sorted(spikes))
+        else:
+            terminal = rng.choices(TERMINALS, terminal_weights)[0]
+            incident_type = rng.choices(INCIDENT_TYPES, TYPE_WEIGHTS)[0]
+        severity = rng.choices(SEVERITIES, SEVERITY_WEIGHTS)[0]
+        part = rng.choice(PARTS[incident_type])
+        description = f"{part.capitalize()} {rng.choice(FINDINGS)} at platform {rng.randint(1, 6)}."
+        date = start + datetime.timedelta(seconds=(i + rng.random()) * step)
+        yield (terminal, incident_type, severity, description, rng.choice(ACTIONS),
+               date.strftime(database.DATE_FORMAT), None)
+
+
+def records(n, seed=DEFAULT_SEED):
+    """incidents() as (location, record) pairs for ingest.ingest()."""
+    for i, row in enumerate(incidents(n, seed), 1):
+        yield f"synthetic:{i}", dict(zip(ingest.FIELDS, row))
+
+
+def build_db(path, n, seed=DEFAULT_SEED):
+    """Creates a fresh database at path holding n synthetic incidents.
+
+    Points database.DB_NAME at path, which every module then uses.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.DB_NAME = path
+    return ingest.ingest(records(n, seed), batch_size=100000, defer_maintenance=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write seeded synthetic incidents as JSONL")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--out", required=True, help="JSONL file, loadable with ingest.py")
+    args = parser.parse_args(argv)
+
+    with open(args.out, "w") as f:
+        for _, record in records(args.rows, args.seed):
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import functools
+import threading
+from collections import OrderedDict
+
+from database import (
+    daily_counts, data_version, incident_changes, incident_ids, list_terminals, rollup_counts,
+    rollup_totals,
+)
+
+# pandas, numpy, plotly and the analytics engine are imported inside the
+# functions below, so modules that only need the constants or the caches
+# (the incident feed, the login page) load without them.
+CACHE_MAX_ENTRIES = 32
+POLL_INTERVAL_SECONDS = 30
+
+SEVERITY_COLORS = {"Critical": "#ff4d4d", "High": "#ffa31a", "Medium": "#33ccff", "Low": "#70db70"}
+
+
+class VersionedCache:
+    """LRU cache whose entries are only valid for one database data_version.
+
+    When the version moves on, every entry is dropped at once; until then
+    reruns are answered from memory without touching SQLite.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get_or_build(self, key, version, build):
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self.version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._entries[key]
+            self.stats["misses"] += 1
+
+        value = build()
+
+        with self._lock:
+            # Skip storing if the data changed while we were building
+            if version == self.version:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "version": self.version}
+
+
+_cache = VersionedCache()
+
+
+class IncidentStore:
+    """Per-session copy of the incidents table kept current with delta syncs.
+
+    The first sync loads everything; later ones only fetch rows changed since
+    the last version seen, so a refresh costs as much as the new incidents.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._rows = {}
+        self._list = []
+        self.last_changes = 0
+
+    def sync(self):
+        """Merges changes from the database and returns how many there were."""
+        if self.version is not None and data_version() == self.version:
+            self.last_changes = 0
+            return 0
+
+        rows, deleted, version = incident_changes(self.version)
+        if deleted is None:
+            # The tombstones we had not seen were pruned: compare ids instead
+            deleted = list(self._rows.keys() - set(incident_ids()))
+        appended_only = not deleted and all(r[0] not in self._rows for r in rows)
+        for row in rows:
+            self._rows[row[0]] = row
+        for incident_id in deleted:
+            self._rows.pop(incident_id, None)
+
+        # New ids are always larger, so pure inserts extend the list in place;
+        # edits and deletes rebuild it (the dict keeps id order either way).
+        if appended_only:
+            self._list.extend(rows)
+        else:
+            self._list = list(self._rows.values())
+        self.version = version
+        self.last_changes = len(rows) + len(deleted)
+        return self.last_changes
+
+    def incidents(self):
+        return self._list
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def cached(fn):
+    """Caches fn(*args) until the incidents data version changes."""
+    @functools.wraps(fn)
+    def wrapper(*args):
+        return _cache.get_or_build((fn.__name__, args), data_version(), lambda: fn(*args))
+    return wrapper
+
+
+def cache_stats():
+    return _cache.snapshot()
+
+
+@cached
+def terminals():
+    return list_terminals()
+
+
+@cached
+def kpis():
+    totals = rollup_totals()
+    critical = totals["by_severity"].get("Critical", 0)
+    return {
+        "total": totals["total"],
+        "critical": critical,
+        "score": max(100 - critical * 10, 0),
+    }
+
+
+@cached
+def terminal_figure():
+    import pandas as pd
+    import plotly.express as px
+
+    t_data = pd.DataFrame(rollup_counts("terminal"), columns=["Terminal", "Count"])
+    fig_t = px.bar(t_data, x="Terminal", y="Count", title="Incidents by Terminal", color_discrete_sequence=['#a2ffff'], template="plotly_dark")
+    fig_t.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+    return fig_t
+
+
+@cached
+def severity_figure():
+    import pandas as pd
+    import plotly.express as px
+
+    s_data = pd.DataFrame(rollup_counts("severity"), columns=["Severity", "Count"])
+    fig_s = px.pie(s_data, values="Count", names="Severity", title="Risk Distribution", hole=0.5, color="Severity", color_discrete_map=SEVERITY_COLORS, template="plotly_dark")
+    fig_s.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+    return fig_s
+
+
+@cached
+def incident_analytics():
+    """analytics.analyze() over the whole table, recomputed once per data version."""
+    import analytics
+
+    return analytics.analyze(analytics.load())
+
+
+@cached
+def trend_figure():
+    import plotly.express as px
+
+    import analytics
+
+    # From the trigger-maintained daily buckets: a few rows per day, not per incident
+    rows = daily_counts()
+    daily = analytics.daily_trend_from_counts([r[0] for r in rows], [r[2] for r in rows])
+    fig = px.line(daily, x="Date", y=["Incidents", f"{analytics.TREND_SHORT_DAYS}d Avg", f"{analytics.TREND_LONG_DAYS}d Avg"],
+                  title="Daily Incident Rate", color_discrete_sequence=['rgba(162,255,255,0.35)', '#a2ffff', '#ffa31a'], template="plotly_dark")
+    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_title_text="")
+    return fig
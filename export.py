@@ -0,0 +1,115 @@
+import csv
+import io
+
+from database import iter_incidents
+
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_COLUMNS = ("id", "terminal", "incident_type", "severity", "description", "action_taken", "date", "evidence")
+EXPORT_HEADERS = ["ID", "Terminal", "Incident Type", "Severity", "Description", "Action Taken", "Date", "Evidence"]
+
+FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+
+def iter_csv(chunk_rows=EXPORT_CHUNK_ROWS, **filters):
+    """Yields the audit log as UTF-8 CSV bytes, one chunk of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    for rows in iter_incidents(columns=EXPORT_COLUMNS, chunk_size=chunk_rows, **filters):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_csv(out, chunk_rows=EXPORT_CHUNK_ROWS, **filters):
+    for chunk in iter_csv(chunk_rows, **filters):
+        out.write(chunk)
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [("ID", pa.int64())] + [(name, pa.string()) for name in EXPORT_HEADERS[1:]]
+    )
+
+
+def _iter_batches(chunk_rows, filters):
+    import pyarrow as pa
+
+    schema = _arrow_schema()
+    for rows in iter_incidents(columns=EXPORT_COLUMNS, chunk_size=chunk_rows, **filters):
+        # Transpose the chunk into columns; nothing beyond one chunk is held
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def write_parquet(out, chunk_rows=EXPORT_CHUNK_ROWS, **filters):
+    """Writes the audit log as Parquet, one row group per chunk."""
+    import pyarrow.parquet as pq
+
+    with pq.ParquetWriter(out, _arrow_schema(), compression="zstd") as writer:
+        for batch in _iter_batches(chunk_rows, filters):
+            writer.write_batch(batch)
+
+
+def write_arrow(out, chunk_rows=EXPORT_CHUNK_ROWS, **filters):
+    """Writes the audit log as an Arrow IPC file, one record batch per chunk."""
+    import pyarrow as pa
+
+    with pa.ipc.new_file(out, _arrow_schema()) as writer:
+        for batch in _iter_batches(chunk_rows, filters):
+            writer.write_batch(batch)
+
+
+WRITERS = {"CSV": write_csv, "Parquet": write_parquet, "Arrow": write_arrow}
+
+
+def export_buffer(fmt="CSV", **filters):
+    """Streams an export into an in-memory buffer, for the dashboard download."""
+    out = io.BytesIO()
+    WRITERS[fmt](out, **filters)
+    out.seek(0)
+    return out
+
+
+def export_to_path(path, fmt="CSV", **filters):
+    """Streams an export straight to a file on disk."""
+    with open(path, "wb") as out:
+        WRITERS[fmt](out, **filters)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the incident audit log")
+    parser.add_argument("path", help="output file")
+    parser.add_argument("--format", choices=list(WRITERS), default="CSV")
+    parser.add_argument("--terminal")
+    parser.add_argument("--incident-type")
+    parser.add_argument("--severity")
+    parser.add_argument("--date-from", help="inclusive, YYYY-MM-DD")
+    parser.add_argument("--date-to", help="exclusive, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    filters = {
+        "terminal": args.terminal, "incident_type": args.incident_type, "severity": args.severity,
+        "date_from": args.date_from, "date_to": args.date_to,
+    }
+    export_to_path(args.path, args.format, **filters)
+    print(f"Exported to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
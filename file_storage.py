@@ -1,33 +1,289 @@
+import datetime
+import hashlib
+import mimetypes
 import os
+import uuid
+from pathlib import PureWindowsPath
 
-UPLOAD_ROOT = "uploads"
+import metrics
+from database import connection, transaction
 
-def save_document(file, terminal):
-    terminal_path = os.path.join(UPLOAD_ROOT, terminal)
+UPLOAD_ROOT = "uploaded_evidence"
+OBJECTS_DIR = os.path.join(UPLOAD_ROOT, "objects")
+CHUNK_SIZE = 1024 * 1024   # bytes read, hashed and written per step
 
-    # Create terminal folder if not exists
-    os.makedirs(terminal_path, exist_ok=True)
+# Content-addressed layout: every distinct file is stored once under
+# objects/<first two hex chars>/<sha256>. evidence_blobs describes the bytes,
+# evidence records each upload (name, terminal, incident) pointing at a blob,
+# so the same photo filed at two terminals costs one copy on disk.
+EVIDENCE_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS evidence_blobs (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mime_type TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS evidence (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sha256 TEXT NOT NULL REFERENCES evidence_blobs(sha256),
+        file_name TEXT,
+        terminal TEXT,
+        incident_id INTEGER,
+        uploaded_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_evidence_terminal ON evidence(terminal)",
+    "CREATE INDEX IF NOT EXISTS idx_evidence_incident ON evidence(incident_id)",
+    "CREATE INDEX IF NOT EXISTS idx_evidence_sha256 ON evidence(sha256)",
+)
 
-    file_path = os.path.join(terminal_path, file.name)
+EVIDENCE_COLUMNS = (
+    "e.id", "e.file_name", "e.terminal", "e.incident_id", "e.uploaded_at",
+    "b.sha256", "b.size", "b.mime_type", "b.path",
+    "ty.name AS incident_type", "sv.name AS severity",
+)
+EVIDENCE_KEYS = tuple(c.split(" AS ")[-1].split(".")[-1] for c in EVIDENCE_COLUMNS)
+_EVIDENCE_SELECT = (
+    f"SELECT {', '.join(EVIDENCE_COLUMNS)} FROM evidence e"
+    " JOIN evidence_blobs b USING (sha256)"
+    " LEFT JOIN incidents i ON i.id = e.incident_id"
+    " LEFT JOIN incident_types ty ON ty.id = i.incident_type_id"
+    " LEFT JOIN severities sv ON sv.id = i.severity_id"
+)
 
-    with open(file_path, "wb") as f:
-        f.write(file.getbuffer())
+# Magic numbers for the types the officer form accepts
+_SIGNATURES = (
+    (b"%PDF", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
 
-    return file_path
 
+def create_evidence_store(conn):
+    """Schema migration step: evidence tables, indexing any legacy uploads."""
+    existing = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'evidence'"
+    ).fetchone()
+    for ddl in EVIDENCE_DDL:
+        conn.execute(ddl)
+    # First run: files uploaded before the store existed are indexed once the
+    # migration has committed, so hashing them never holds the write lock
+    if not existing:
+        return index_legacy_files
+
+
+def object_path(sha256):
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256)
+
+
+def _guess_mime(head, file_name):
+    for magic, mime in _SIGNATURES:
+        if head.startswith(magic):
+            return mime
+    return mimetypes.guess_type(file_name or "")[0] or "application/octet-stream"
+
+
+def _register_blob(conn, sha256, path, size, mime_type):
+    conn.execute(
+        "INSERT OR IGNORE INTO evidence_blobs (sha256, path, size, mime_type) VALUES (?, ?, ?, ?)",
+        (sha256, path, size, mime_type),
+    )
+    return conn.execute("SELECT path FROM evidence_blobs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+
+@metrics.timed("evidence.store_blob")
+def store_blob(file):
+    """Streams an uploaded file into the object store and returns its blob record.
+
+    Bytes are hashed while they are written to a temp file, which is then
+    renamed into place atomically. If the content is already stored the temp
+    file is discarded, so duplicates cost nothing on disk.
+    """
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    tmp_path = os.path.join(OBJECTS_DIR, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+
+    if hasattr(file, "seek"):
+        file.seek(0)
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not head:
+                    head = chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        metrics.count("evidence.bytes_written", size)
+
+        sha256 = digest.hexdigest()
+        final_path = object_path(sha256)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    mime_type = _guess_mime(head, getattr(file, "name", None))
+    with transaction() as conn:
+        path = _register_blob(conn, sha256, final_path, size, mime_type)
+    return {"sha256": sha256, "path": path, "size": size, "mime_type": mime_type}
+
+
+def record_evidence(blob, file_name, terminal, incident_id=None, uploaded_at=None):
+    """Adds an evidence entry for a stored blob and returns its id."""
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO evidence (sha256, file_name, terminal, incident_id, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+            (blob["sha256"], file_name, terminal, incident_id,
+             uploaded_at or str(datetime.datetime.now())),
+        )
+        return cur.lastrowid
+
+
+def _legacy_key(path):
+    # The old form ran on Windows and stored paths like uploaded_evidence\Kakkanad\x.jpg
+    return PureWindowsPath(path).as_posix()
 
-def get_terminal_folders():
-    if not os.path.exists(UPLOAD_ROOT):
-        return []
 
-    return [f for f in os.listdir(UPLOAD_ROOT)
-            if os.path.isdir(os.path.join(UPLOAD_ROOT, f))]
+def index_legacy_files(db_name=None):
+    """Indexes files saved as UPLOAD_ROOT/<terminal>/<name> by the old form.
 
+    Files stay where they are; their blob path points at the existing file.
+    Entries are linked to incidents whose evidence column names that path.
+    Every file is hashed before the write lock is taken, then all of them are
+    inserted in one short transaction.
+    """
+    if not os.path.isdir(UPLOAD_ROOT):
+        return 0
 
-def get_files_in_terminal(terminal):
-    terminal_path = os.path.join(UPLOAD_ROOT, terminal)
+    found = []
+    for dirpath, dirnames, filenames in os.walk(UPLOAD_ROOT):
+        if dirpath == UPLOAD_ROOT and "objects" in dirnames:
+            dirnames.remove("objects")
+        rel = os.path.relpath(dirpath, UPLOAD_ROOT)
+        terminal = None if rel == "." else rel.split(os.sep)[0]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            digest = hashlib.sha256()
+            head = b""
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    head = head or chunk[:16]
+                    digest.update(chunk)
+            found.append((digest.hexdigest(), path, name, terminal, os.path.getsize(path), _guess_mime(head, name),
+                          str(datetime.datetime.fromtimestamp(os.path.getmtime(path)))))
+    if not found:
+        return 0
 
-    if not os.path.exists(terminal_path):
-        return []
+    with transaction(db_name) as conn:
+        incident_for = {}
+        for evidence, incident_id in conn.execute(
+            "SELECT evidence, MAX(id) FROM incidents WHERE evidence IS NOT NULL GROUP BY evidence"
+        ):
+            key = _legacy_key(evidence)
+            incident_for[key] = max(incident_id, incident_for.get(key, incident_id))
+        for sha256, path, name, terminal, size, mime_type, uploaded_at in found:
+            _register_blob(conn, sha256, path, size, mime_type)
+            conn.execute(
+                "INSERT INTO evidence (sha256, file_name, terminal, incident_id, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, name, terminal, incident_for.get(_legacy_key(path)), uploaded_at),
+            )
+    return len(found)
+
+
+def list_evidence(terminal=None, incident_id=None, before_id=None, limit=None):
+    """Evidence metadata rows (EVIDENCE_COLUMNS order), newest first, from the index."""
+    clauses, params = [], []
+    if terminal is not None:
+        clauses.append("e.terminal = ?")
+        params.append(terminal)
+    if incident_id is not None:
+        clauses.append("e.incident_id = ?")
+        params.append(incident_id)
+    if before_id is not None:
+        clauses.append("e.id < ?")
+        params.append(before_id)
+
+    sql = _EVIDENCE_SELECT
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY e.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def evidence_for_incidents(incident_ids):
+    """Maps incident id -> (sha256, path, mime_type, file_name) for the first file of each."""
+    incident_ids = list(incident_ids)
+    if not incident_ids:
+        return {}
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT e.incident_id, b.sha256, b.path, b.mime_type, e.file_name"
+            " FROM evidence e JOIN evidence_blobs b USING (sha256)"
+            f" WHERE e.incident_id IN ({', '.join('?' * len(incident_ids))})"
+            " ORDER BY e.id DESC", incident_ids
+        ).fetchall()
+    return {r[0]: r[1:] for r in rows}
+
+
+def count_evidence(terminal=None):
+    with connection() as conn:
+        if terminal is None:
+            return conn.execute("SELECT COUNT(*) FROM evidence").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM evidence WHERE terminal = ?", (terminal,)).fetchone()[0]
+
+
+def get_evidence(evidence_id):
+    """Metadata for one evidence entry as a dict keyed by EVIDENCE_KEYS, or None."""
+    with connection() as conn:
+        row = conn.execute(_EVIDENCE_SELECT + " WHERE e.id = ?", (evidence_id,)).fetchone()
+    return dict(zip(EVIDENCE_KEYS, row)) if row else None
+
+
+@metrics.timed("evidence.read")
+def read_evidence(evidence_id):
+    """Loads one evidence file's bytes; only called when a download or preview asks.
+
+    Raises FileNotFoundError if the stored file has gone from disk.
+    """
+    evidence = get_evidence(evidence_id)
+    if evidence is None:
+        return b""
+    with open(evidence["path"], "rb") as f:
+        data = f.read()
+    metrics.count("evidence.bytes_read", len(data))
+    return data
+
+
+def human_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def get_terminal_folders():
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT terminal FROM evidence WHERE terminal IS NOT NULL ORDER BY terminal"
+        ).fetchall()
+    return [r[0] for r in rows]
 
-    return os.listdir(terminal_path)
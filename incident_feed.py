@@ -0,0 +1,183 @@
+import base64
+import html
+
+import streamlit as st
+
+import file_storage
+import metrics
+import thumbnails
+from dashboard import SEVERITY_COLORS
+from database import SEARCH_WINDOW, count_search, query_incidents, search_incidents
+
+PAGE_SIZES = [10, 25, 50, 100]
+DEFAULT_PAGE_SIZE = 25
+MAX_LOADED_PAGES = 4   # window of pages kept on screen; older ones scroll out
+
+FEED_COLUMNS = ("id", "terminal", "incident_type", "severity", "description", "action_taken", "date")
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MARKS = ("\x02", "\x03")   # survive html.escape, then become <mark> tags
+
+
+def evidence_html(file_name, thumb_path):
+    name = html.escape(str(file_name or "evidence"))
+    label = f'<p style="font-size: 0.85em; opacity: 0.8;">📎 {name}</p>'
+    if not thumb_path:
+        return label
+    try:
+        with open(thumb_path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return label
+    metrics.count("evidence.thumbnail_bytes_read", len(raw))
+    data = base64.b64encode(raw).decode("ascii")
+    return label + f'<img src="data:image/jpeg;base64,{data}" style="max-width: 160px; border-radius: 8px;">'
+
+
+
+def highlight_html(snippet):
+    """Escaped snippet text with the SEARCH_MARKS turned into <mark> tags."""
+    open_mark, close_mark = SEARCH_MARKS
+    return html.escape(snippet or "").replace(open_mark, "<mark>").replace(close_mark, "</mark>")
+
+
+def card_html(incident_id, terminal, incident_type, severity, description, action_taken, date, evidence="",
+              highlighted=False):
+    esc = lambda value: html.escape(str(value or ""))
+    text = highlight_html if highlighted else esc
+    sev_color = SEVERITY_COLORS.get(severity, "white")
+    return f"""
+<div class="incident-card">
+<h3 style="margin:0; color: #a2ffff !important;">🏢 {esc(terminal)}</h3>
+<p style="margin:5px 0; font-size: 0.9em;">
+<b>TYPE:</b> {esc(incident_type)} | <b>SEVERITY:</b> <span style="color:{sev_color}; font-weight:bold;">{esc(severity).upper()}</span> | <b>DATE:</b> {esc(date)[:10]}
+</p>
+<p style="opacity: 0.9; margin-top:10px;">{text(description)}</p>
+<div style="margin-top:10px; padding-top:10px; border-top: 1px solid rgba(255,255,255,0.1); font-size: 0.85em;">
+<b>RESPONSE:</b> {text(action_taken)}
+</div>
+{evidence}
+</div>"""
+
+
+def _evidence_extras(rows):
+    # Evidence thumbnails for the whole page in two indexed lookups; the
+    # full-size files stay on disk until opened in the Evidence Explorer
+    evidence = file_storage.evidence_for_incidents(row[0] for row in rows)
+    thumbs = thumbnails.thumbnail_paths((sha, path, mime) for sha, path, mime, _ in evidence.values())
+    return {
+        incident_id: evidence_html(file_name, thumbs.get(sha))
+        for incident_id, (sha, _, _, file_name) in evidence.items()
+    }
+
+
+def _load_page(state):
+    rows = query_incidents(
+        columns=FEED_COLUMNS, before_id=state["cursor"], limit=state["page_size"], **state["filters"]
+    )
+    if rows:
+        extras = _evidence_extras(rows)
+        # One pre-rendered HTML block per page: reruns reuse it without querying
+        state["pages"].append((len(rows), "".join(card_html(*row, extras.get(row[0], "")) for row in rows)))
+        state["cursor"] = rows[-1][0]
+        state["loaded"] += len(rows)
+    if len(rows) < state["page_size"]:
+        state["done"] = True
+    if len(state["pages"]) > MAX_LOADED_PAGES:
+        count, _ = state["pages"].pop(0)
+        state["scrolled_out"] += count
+
+
+def _reset(state_key, filters, page_size, version):
+    st.session_state[state_key] = {
+        "filters": filters, "page_size": page_size, "version": version,
+        "pages": [], "cursor": None, "loaded": 0, "scrolled_out": 0, "done": False,
+    }
+
+
+def _clear(state_key):
+    st.session_state.pop(state_key, None)
+
+
+def render_feed(filters, version, key="feed"):
+    """Paged incident feed rendered one markdown block per page.
+
+    Pages are fetched with keyset pagination and kept in session state, so a
+    rerun without new data neither queries SQLite nor rebuilds card HTML.
+    "Load more" appends the next page; only the last MAX_LOADED_PAGES stay on
+    screen, which keeps render time flat however long the history is.
+    """
+    page_size = st.selectbox("Cards per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE), key=f"{key}_page_size")
+
+    state_key = f"{key}_state"
+    state = st.session_state.get(state_key)
+    if state is None or (state["filters"], state["page_size"], state["version"]) != (filters, page_size, version):
+        _reset(state_key, filters, page_size, version)
+        state = st.session_state[state_key]
+        _load_page(state)
+
+    if state["scrolled_out"]:
+        st.button("⬆️ Back to newest", key=f"{key}_top", on_click=_clear, args=(state_key,))
+
+    if not state["pages"]:
+        st.info("No incidents match this filter.")
+        return
+
+    for _, page_html in state["pages"]:
+        st.markdown(page_html, unsafe_allow_html=True)
+
+    st.caption(f"Showing incidents {state['scrolled_out'] + 1}–{state['loaded']}"
+               + ("" if state["done"] else " · more available"))
+    if not state["done"]:
+        st.button("⬇️ Load more", key=f"{key}_more", on_click=_load_page, args=(state,))
+
+
+def _search_page(state, step=0):
+    state["page"] += step
+    state["html"] = None
+
+
+def render_search(text, filters, version, key="search"):
+    """Full-text search results, one page at a time: best match first, or
+    newest first when there are more than SEARCH_WINDOW matches.
+
+    Cards show snippets with the matched words highlighted. The rendered
+    page stays in session state until the query, filters, page or data
+    version change, so reruns do not search again.
+    """
+    state_key = f"{key}_state"
+    state = st.session_state.get(state_key)
+    if state is None or (state["text"], state["filters"], state["version"]) != (text, filters, version):
+        state = st.session_state[state_key] = {
+            "text": text, "filters": filters, "version": version,
+            "page": 0, "html": None, "total": count_search(text, **filters),
+        }
+    if not state["total"]:
+        st.info("No incidents match this search.")
+        return
+
+    start = state["page"] * SEARCH_PAGE_SIZE
+    if state["html"] is None:
+        rows = search_incidents(text, columns=FEED_COLUMNS, limit=SEARCH_PAGE_SIZE, offset=start,
+                                marks=SEARCH_MARKS, **filters)
+        extras = _evidence_extras(rows) if rows else {}
+        # The two trailing snippet columns stand in for description and response
+        state["html"] = "".join(
+            card_html(*row[:4], row[7], row[8], row[6], extras.get(row[0], ""), highlighted=True) for row in rows
+        )
+    st.markdown(state["html"], unsafe_allow_html=True)
+
+    total = state["total"]
+    end = min(start + SEARCH_PAGE_SIZE, total)
+    ranked = total <= SEARCH_WINDOW
+    if ranked:
+        st.caption(f"Matches {start + 1}–{end} of {total:,}")
+    else:
+        st.caption(f"Matches {start + 1}–{end} of {total:,}, newest first · refine the search to rank them by relevance")
+    prev_col, _, next_col = st.columns([1, 4, 1])
+    if state["page"]:
+        prev_col.button("⬅️ Better matches" if ranked else "⬅️ Newer", key=f"{key}_prev",
+                        on_click=_search_page, args=(state, -1))
+    if end < total:
+        next_col.button("More matches ➡️" if ranked else "Older ➡️", key=f"{key}_next",
+                        on_click=_search_page, args=(state, 1))
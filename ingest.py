@@ -0,0 +1,222 @@
+import csv
+import datetime
+import json
+import sys
+import time
+
+from database import (
+    INCIDENT_TYPES, INSERT_INCIDENT_SQL, SEVERITIES, TERMINALS,
+    bulk_load, dimension_ids, migrate, to_epoch, transaction,
+)
+
+# Bulk backfill of incident logs from CSV or JSONL. Records are validated
+# one by one and inserted with executemany, BATCH_SIZE rows per
+# transaction, instead of one connection and commit per row as
+# insert_incident does.
+BATCH_SIZE = 20000
+MAX_REJECTS_KEPT = 1000         # rejected lines remembered for the report
+REJECTS_SHOWN = 20
+
+FIELDS = ("terminal", "incident_type", "severity", "description", "action_taken", "date", "evidence")
+ALLOWED = {"terminal": TERMINALS, "incident_type": INCIDENT_TYPES, "severity": SEVERITIES}
+
+# Header spellings accepted besides FIELDS, including the export and form labels.
+# Other columns (e.g. an exported ID) are ignored; every row gets a new id.
+FIELD_ALIASES = {
+    "terminal location": "terminal",
+    "incident type": "incident_type",
+    "incident category": "incident_type",
+    "category": "incident_type",
+    "type": "incident_type",
+    "severity level": "severity",
+    "action taken": "action_taken",
+    "action": "action_taken",
+    "timestamp": "date",
+}
+
+# Known values match case-insensitively and are stored in their canonical spelling
+_CANONICAL = {field: {v.casefold(): v for v in values} for field, values in ALLOWED.items()}
+
+
+def _field_name(header):
+    key = header.strip().casefold()
+    return FIELD_ALIASES.get(key, key.replace(" ", "_"))
+
+
+def validate(record, date_format=None):
+    """The (terminal, type, severity, description, action, ts, evidence) tuple for one record.
+
+    Raises ValueError naming the first problem. Dates are ISO 8601 text unless
+    date_format (a strptime format) is given; blank values count as missing.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    fields = {}
+    for header, value in record.items():
+        if header is None:              # csv puts surplus cells under None
+            continue
+        if isinstance(value, str):
+            value = value.strip() or None
+        fields[_field_name(header)] = value
+
+    names = []
+    for field in ALLOWED:
+        value = fields.get(field)
+        if value is None:
+            raise ValueError(f"missing {field}")
+        name = _CANONICAL[field].get(str(value).casefold())
+        if name is None:
+            raise ValueError(f"unknown {field} {value!r}")
+        names.append(name)
+
+    date = fields.get("date")
+    # to_epoch also takes epoch numbers, but in a file they are almost
+    # always a wrong column, so only text is accepted here
+    if date is not None and not isinstance(date, (str, datetime.date)):
+        raise ValueError(f"bad date {date!r}")
+    try:
+        if date_format and isinstance(date, str):
+            date = datetime.datetime.strptime(date, date_format)
+        ts = to_epoch(date)
+    except (TypeError, ValueError):
+        raise ValueError(f"bad date {date!r}") from None
+    return (*names, fields.get("description"), fields.get("action_taken"), ts, fields.get("evidence"))
+
+
+def read_records(path, fmt=None):
+    """Yields (location, record) pairs from a CSV or JSONL file; '-' reads stdin.
+
+    The format follows the file extension unless fmt ('csv' or 'jsonl') is
+    given. Lines that are not valid JSON come through as ValueError
+    instances, so they are rejected like any other bad record.
+    """
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+    f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8-sig")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield f"{path}:{reader.line_num}", record
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = ValueError(f"invalid JSON ({e})")
+                yield f"{path}:{line_no}", record
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def ingest(records, batch_size=BATCH_SIZE, defer_maintenance=False, strict=False,
+           date_format=None, progress=None):
+    """Validates and inserts (location, record) pairs; returns the run's stats.
+
+    Each batch is one executemany in its own transaction, so an interrupted
+    load keeps every finished batch. With defer_maintenance the whole load
+    is a single transaction under database.bulk_load(): indexes, rollups
+    and change stamps are brought up to date once at the end, and the write
+    lock is held throughout. Invalid records are skipped and reported, or
+    raise ValueError when strict. progress(stats) is called after every batch.
+    """
+    migrate()
+    stats = {"read": 0, "inserted": 0, "rejected": 0, "rejects": [], "seconds": 0.0, "rows_per_s": 0.0}
+    start = time.perf_counter()
+
+    with transaction() as conn:
+        keys = [dimension_ids(conn, field, values) for field, values in ALLOWED.items()]
+
+    def batches():
+        batch = []
+        for location, record in records:
+            stats["read"] += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(validate(record, date_format))
+            except ValueError as e:
+                if strict:
+                    raise ValueError(f"{location}: {e}") from None
+                stats["rejected"] += 1
+                if len(stats["rejects"]) < MAX_REJECTS_KEPT:
+                    stats["rejects"].append((location, str(e)))
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def insert(conn, batch):
+        terminal_ids, type_ids, severity_ids = keys
+        conn.executemany(INSERT_INCIDENT_SQL, [
+            (terminal_ids[t], type_ids[ty], severity_ids[sv], *rest) for t, ty, sv, *rest in batch
+        ])
+        stats["inserted"] += len(batch)
+        _timing(stats, start)
+        if progress:
+            progress(stats)
+
+    if defer_maintenance:
+        with transaction() as conn, bulk_load(conn):
+            for batch in batches():
+                insert(conn, batch)
+    else:
+        for batch in batches():
+            with transaction() as conn:
+                insert(conn, batch)
+    _timing(stats, start)
+    return stats
+
+
+def _timing(stats, start):
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_s"] = stats["inserted"] / stats["seconds"] if stats["seconds"] else 0.0
+
+
+def ingest_files(paths, fmt=None, **options):
+    """ingest() over several files in order, as one load."""
+    return ingest((item for path in paths for item in read_records(path, fmt)), **options)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-load incident logs from CSV or JSONL")
+    parser.add_argument("paths", nargs="+", metavar="FILE", help="input files; '-' reads stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: by extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--defer-maintenance", action="store_true",
+                        help="drop indexes and triggers during the load and rebuild them once at the end")
+    parser.add_argument("--strict", action="store_true", help="stop at the first invalid record")
+    parser.add_argument("--date-format", help="strptime format for dates that are not ISO 8601")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args(argv)
+
+    def report(stats):
+        print(f"\r{stats['inserted']:>12,} rows  {stats['rows_per_s']:>10,.0f} rows/s", end="", file=sys.stderr)
+
+    try:
+        stats = ingest_files(
+            args.paths, args.format, batch_size=args.batch_size, defer_maintenance=args.defer_maintenance,
+            strict=args.strict, date_format=args.date_format, progress=None if args.quiet else report,
+        )
+    except ValueError as e:
+        print(f"\nAborted: {e}", file=sys.stderr)
+        return 1
+    if not args.quiet and stats["inserted"]:
+        print(file=sys.stderr)
+    for location, error in stats["rejects"][:REJECTS_SHOWN]:
+        print(f"Rejected {location}: {error}", file=sys.stderr)
+    if stats["rejected"] > REJECTS_SHOWN:
+        print(f"... and {stats['rejected'] - REJECTS_SHOWN} more", file=sys.stderr)
+    print(f"Inserted {stats['inserted']:,} of {stats['read']:,} records ({stats['rejected']:,} rejected)"
+          f" in {stats['seconds']:.1f}s, {stats['rows_per_s']:,.0f} rows/s.")
+    return 1 if stats["rejected"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,184 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from database import connection, transaction
+
+MAX_WORKERS = 2
+JOB_STALE_S = 60 * 60              # queued/running rows older than this are treated as dead
+JOB_RETENTION_S = 7 * 24 * 60 * 60
+
+# One row per background job. Workers update status and progress as they go;
+# the UI only ever reads the row, so a script rerun never waits on the work.
+JOBS_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_kind_key ON jobs(kind, key, created_at)",
+)
+
+JOB_KEYS = ("id", "kind", "key", "status", "progress", "message", "result", "error",
+            "created_at", "started_at", "finished_at")
+
+_executor = None
+_inflight = {}   # (kind, key) -> job id of the queued or running job
+_lock = threading.Lock()
+
+
+def create_jobs_table(conn):
+    """Schema migration step."""
+    for ddl in JOBS_DDL:
+        conn.execute(ddl)
+
+
+def _get_executor():
+    """The worker pool, created on first use. Called with _lock held."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+    return _executor
+
+
+def submit(kind, key, fn, *args, **kwargs):
+    """Runs fn(*args, progress=..., **kwargs) in the background and returns a job id.
+
+    While a job with the same kind and key is queued or running in this
+    process its id is returned instead, so concurrent identical requests
+    share one run. fn's return value must be JSON-serialisable.
+    """
+    with _lock:
+        job_id = _inflight.get((kind, key))
+        if job_id is not None:
+            return job_id
+    # The row is written without _lock held, so a slow write lock never
+    # blocks submits or finishing jobs for other keys
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with transaction() as conn:
+        if _executor is None:
+            # Jobs whose process died never finish; close them so nobody waits forever
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'interrupted', finished_at = ?"
+                " WHERE status IN ('queued', 'running') AND created_at < ?",
+                (now, now - JOB_STALE_S),
+            )
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RETENTION_S,))
+        conn.execute(
+            "INSERT INTO jobs (id, kind, key, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+            (job_id, kind, key, now),
+        )
+    with _lock:
+        running = _inflight.setdefault((kind, key), job_id)
+        executor = _get_executor()
+    if running != job_id:
+        # An identical submit got in first: share its run and drop this row
+        with transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return running
+    executor.submit(_run, job_id, kind, key, fn, args, kwargs)
+    return job_id
+
+
+def _run(job_id, kind, key, fn, args, kwargs):
+    # Whatever fails, even the status updates, the key is released and the
+    # row closed, so a later submit() can run it again
+    status, result, error = "failed", None, "interrupted"
+    try:
+        with transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+        result = json.dumps(
+            fn(*args, progress=lambda fraction, message=None: set_progress(job_id, fraction, message), **kwargs)
+        )
+        status, error = "done", None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        with _lock:
+            _inflight.pop((kind, key), None)
+        with transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+
+def set_progress(job_id, fraction, message=None):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET progress = ?, message = IFNULL(?, message) WHERE id = ?",
+            (max(0.0, min(1.0, fraction)), message, job_id),
+        )
+
+
+def get_job(job_id):
+    """The job row as a dict with its result decoded, or None."""
+    with connection() as conn:
+        row = conn.execute(f"SELECT {', '.join(JOB_KEYS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(JOB_KEYS, row))
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+class RateLimiter:
+    """Token bucket shared by every thread that calls acquire()."""
+
+    def __init__(self, rate_per_s, burst=1):
+        self.rate = rate_per_s
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry(fn, retry_on, attempts=5, base_delay=1.0, max_delay=30.0, limiter=None):
+    """Calls fn(), retrying retry_on errors with exponential backoff and jitter.
+
+    A Retry-After header on the error's response, when present, sets the
+    minimum wait. The limiter, if given, is acquired before every attempt.
+    """
+    for attempt in range(attempts):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            response = getattr(e, "response", None)
+            retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+            try:
+                delay = max(delay, min(max_delay, float(retry_after)))
+            except (TypeError, ValueError):
+                pass
+            time.sleep(delay)
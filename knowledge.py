@@ -0,0 +1,225 @@
+import re
+import threading
+import time
+
+import jobs
+from database import connection, migrate, transaction
+
+# Guideline passages for the Safety Advisor. Text is extracted from PDF
+# evidence, split into overlapping passages per page and indexed with FTS5,
+# whose bm25() ranks them for a question. Documents are keyed by content
+# hash, so a file uploaded at several terminals is indexed once; indexing is
+# incremental and only ever looks at blobs it has not seen.
+PASSAGE_WORDS = 120
+PASSAGE_OVERLAP = 30            # words repeated at the start of the next passage
+MAX_PAGES = 500                 # per document
+TOP_PASSAGES = 3
+MIN_RELATIVE_SCORE = 0.5        # passages scoring under half the best are left out
+
+PASSAGE_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS passage_sources (
+        sha256 TEXT PRIMARY KEY,
+        pages INTEGER NOT NULL,
+        passages INTEGER NOT NULL,
+        indexed_at REAL NOT NULL,
+        error TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS passages (
+        id INTEGER PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        text TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_passages_sha256 ON passages(sha256)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(
+        text, content = 'passages', content_rowid = 'id',
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """,
+)
+
+# Words that say nothing about what a question is about
+QUESTION_STOPWORDS = frozenset("""
+    a an and are as at be can could do does for from how i if in is it me my of on or our should
+    so that the there this to us was we what when where which who why will with would you your
+""".split())
+
+_PENDING_SQL = (
+    "SELECT b.sha256, b.path FROM evidence_blobs b"
+    " WHERE b.mime_type = 'application/pdf'"
+    " AND NOT EXISTS (SELECT 1 FROM passage_sources s WHERE s.sha256 = b.sha256)"
+)
+
+_index_lock = threading.Lock()
+
+
+def create_passage_tables(conn):
+    """Schema migration step."""
+    for ddl in PASSAGE_DDL:
+        conn.execute(ddl)
+
+
+def extract_pages(path, max_pages=MAX_PAGES):
+    """Text of each page of a PDF, first max_pages pages only."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(path)
+    try:
+        pages = []
+        for i in range(min(len(pdf), max_pages)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
+def chunk_text(text, words=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    """Passages of up to `words` words, each starting `overlap` words before
+    the previous one ended, so a sentence cut at a boundary is whole in one."""
+    tokens = text.split()
+    step = words - overlap
+    return [" ".join(tokens[i:i + words]) for i in range(0, max(len(tokens) - overlap, 1), step)] if tokens else []
+
+
+def pending_documents():
+    """(sha256, path) of stored PDFs that have not been indexed yet."""
+    with connection() as conn:
+        return conn.execute(_PENDING_SQL).fetchall()
+
+
+def index_document(sha256, path):
+    """Extracts and indexes one PDF; returns the number of passages added.
+
+    A file that cannot be read is recorded with its error, so it is not
+    retried on every run.
+    """
+    passages, pages, error = [], 0, None
+    try:
+        page_texts = extract_pages(path)
+        pages = len(page_texts)
+        for page, text in enumerate(page_texts, 1):
+            passages.extend((page, passage) for passage in chunk_text(text))
+    except Exception as e:
+        passages, error = [], f"{type(e).__name__}: {e}"
+
+    with transaction() as conn:
+        # Another process may have indexed it while we were extracting
+        if conn.execute("SELECT 1 FROM passage_sources WHERE sha256 = ?", (sha256,)).fetchone():
+            return 0
+        for page, text in passages:
+            passage_id = conn.execute(
+                "INSERT INTO passages (sha256, page, text) VALUES (?, ?, ?)", (sha256, page, text)
+            ).lastrowid
+            conn.execute("INSERT INTO passages_fts (rowid, text) VALUES (?, ?)", (passage_id, text))
+        conn.execute(
+            "INSERT INTO passage_sources (sha256, pages, passages, indexed_at, error) VALUES (?, ?, ?, ?, ?)",
+            (sha256, pages, len(passages), time.time(), error),
+        )
+    return len(passages)
+
+
+def index_documents(progress=None):
+    """Indexes every stored PDF not indexed yet.
+
+    Returns {"documents", "passages", "failed"} counts for this run. Does
+    nothing when the PDF text extractor (pypdfium2) is not installed.
+    """
+    stats = {"documents": 0, "passages": 0, "failed": 0}
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        return stats
+    with _index_lock:
+        pending = pending_documents()
+        for i, (sha256, path) in enumerate(pending):
+            if progress:
+                progress(i / len(pending), f"Indexing document {i + 1} of {len(pending)}")
+            added = index_document(sha256, path)
+            stats["documents"] += 1
+            stats["passages"] += added
+            stats["failed"] += not added
+    return stats
+
+
+def schedule_indexing():
+    """Starts a background index run if any stored PDF is not indexed; returns the job id or None."""
+    with connection() as conn:
+        if not conn.execute(_PENDING_SQL + " LIMIT 1").fetchone():
+            return None
+    return jobs.submit("passages", "index", index_documents)
+
+
+def normalize_question(text):
+    """Lower-cased words of a question, single-spaced, without punctuation."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def passage_query(text):
+    """FTS5 MATCH expression for a question: any of its content words."""
+    words = dict.fromkeys(w for w in normalize_question(text).split() if w not in QUESTION_STOPWORDS)
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+def search_passages(question, limit=TOP_PASSAGES):
+    """The passages that best answer a question, best first.
+
+    Each is a dict with id, text, page, file_name and terminal (of the
+    first upload of that document).
+    """
+    query = passage_query(question)
+    if not query:
+        return []
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT p.id, p.text, p.page,"
+            " (SELECT e.file_name FROM evidence e WHERE e.sha256 = p.sha256 ORDER BY e.id LIMIT 1),"
+            " (SELECT e.terminal FROM evidence e WHERE e.sha256 = p.sha256 ORDER BY e.id LIMIT 1),"
+            " bm25(passages_fts)"
+            " FROM passages_fts CROSS JOIN passages p ON p.id = passages_fts.rowid"
+            " WHERE passages_fts MATCH ? ORDER BY bm25(passages_fts) LIMIT ?",
+            (query, limit),
+        ).fetchall()
+    # bm25() is negative, more so for better matches; a passage matching
+    # only a side word of the question would otherwise fill the prompt
+    best = rows[0][-1] if rows else 0
+    return [dict(zip(("id", "text", "page", "file_name", "terminal"), row[:-1]))
+            for row in rows if row[-1] <= best * MIN_RELATIVE_SCORE]
+
+
+def source_label(passage):
+    where = f" ({passage['terminal']})" if passage["terminal"] else ""
+    return f"{passage['file_name'] or 'document'}{where}, page {passage['page']}"
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index guideline PDFs for the Safety Advisor")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("index", help="extract and index every stored PDF not indexed yet")
+    search = commands.add_parser("search", help="show the passages retrieved for a question")
+    search.add_argument("question")
+    search.add_argument("--limit", type=int, default=TOP_PASSAGES)
+    args = parser.parse_args(argv)
+
+    migrate()
+    if args.command == "index":
+        stats = index_documents(progress=lambda fraction, message=None: print(message))
+        print(f"Indexed {stats['documents']} documents ({stats['passages']} passages, {stats['failed']} without text).")
+    elif args.command == "search":
+        for passage in search_passages(args.question, args.limit):
+            print(f"[{source_label(passage)}]\n{passage['text']}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal OpenAI-compatible chat completions server for local runs without an
+# API key: point GROQ_BASE_URL at http://127.0.0.1:<port>/v1. Every request
+# gets the same canned reply; streams are sent as server-sent events.
+STUB_REPLY = "Stub safety advice: isolate the hazard, report to the command center and log the incident."
+STUB_TOKEN_DELAY_S = 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+    reply = STUB_REPLY
+    token_delay = STUB_TOKEN_DELAY_S
+    ttft = 0.0
+    requests = 0
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).requests += 1
+        type(self).connections.add(self.client_address)
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        messages = body.get("messages") or [{}]
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 1 for m in messages)
+        words = self.reply.split(" ")
+        time.sleep(self.ttft)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                self._chunk(_sse(_completion(body, delta=delta)))
+                time.sleep(self.token_delay)
+            self._chunk(_sse(_completion(body, delta={}, finish_reason="stop")))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = _completion(body, delta={}, usage=_usage(prompt_tokens, len(words)))
+                usage["choices"] = []
+                self._chunk(_sse(usage))
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+            return
+
+        data = json.dumps(_completion(
+            body, message={"role": "assistant", "content": self.reply}, finish_reason="stop",
+            usage=_usage(prompt_tokens, len(words)),
+        )).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _sse(payload):
+    return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+
+def _usage(prompt_tokens, completion_tokens):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _completion(body, delta=None, message=None, finish_reason=None, usage=None):
+    choice = {"index": 0, "finish_reason": finish_reason}
+    if delta is not None:
+        choice["delta"] = delta
+    if message is not None:
+        choice["message"] = message
+    payload = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk" if delta is not None else "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [choice],
+    }
+    if usage is not None:
+        payload["usage"] = usage
+    return payload
+
+
+def start(port=0, reply=STUB_REPLY, token_delay=STUB_TOKEN_DELAY_S, ttft=0.0):
+    """Starts the stub in a daemon thread; returns (server, base_url)."""
+    handler = type("Handler", (StubHandler,), {
+        "reply": reply, "token_delay": token_delay, "ttft": ttft, "requests": 0, "connections": set(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub LLM server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token-delay", type=float, default=0.05, help="seconds between streamed words")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    args = parser.parse_args(argv)
+
+    server, base_url = start(args.port, token_delay=args.token_delay, ttft=args.ttft)
+    print(f"Stub LLM listening on {base_url} (set GROQ_BASE_URL to this)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Hot-path instrumentation: timed spans, counters and per-rerun breakdowns.
+# Off unless SAFETY_METRICS=1 or enable() is called. While off, span()
+# returns one shared no-op context manager and count() returns after a
+# single flag check, so the calls can stay in hot paths.
+ENABLED = os.environ.get("SAFETY_METRICS", "") not in ("", "0")
+RECENT_SAMPLES = 512            # per span, for the distributions
+RECENT_RUNS = 100               # finished reruns kept for the diagnostics view
+QUANTILES = (0.5, 0.9, 0.99)
+
+# File exports, both optional: a Prometheus text file rewritten after a run
+# at most every EXPORT_INTERVAL_S (for node_exporter's textfile collector),
+# and a JSONL log with one line per finished run.
+EXPORT_PATH = os.environ.get("SAFETY_METRICS_FILE")
+JSONL_PATH = os.environ.get("SAFETY_METRICS_JSONL")
+EXPORT_INTERVAL_S = 10.0
+PROMETHEUS_PREFIX = "safety"
+
+
+class _Series:
+    __slots__ = ("count", "total", "errors", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+_series = {}
+_counters = {}
+_runs = deque(maxlen=RECENT_RUNS)
+_lock = threading.Lock()
+_local = threading.local()
+_last_export = 0.0
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = bool(on)
+
+
+def observe(name, seconds, error=False):
+    """Records one duration for span name, globally and on this thread's run."""
+    with _lock:
+        series = _series.get(name)
+        if series is None:
+            series = _series[name] = _Series()
+        series.count += 1
+        series.total += seconds
+        series.errors += error
+        series.recent.append(seconds)
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["spans"][name] = run["spans"].get(name, 0.0) + seconds
+
+
+def count(name, value=1):
+    """Adds value to counter name, globally and on this thread's run."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["counters"][name] = run["counters"].get(name, 0) + value
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, exc_type is not None)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager timing its block as span name."""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name):
+    """Decorator timing every call as span name."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(name, time.perf_counter() - start, error)
+        return wrapper
+    return decorate
+
+
+# -----------------------------
+# PER-RERUN BREAKDOWN
+# -----------------------------
+# A Streamlit rerun executes the script top to bottom on one thread. The
+# app runs inside script_run() and calls section() as it enters each part of
+# the page; every span and counter on that thread is also charged to the run.
+# Reruns cut short by st.rerun() or st.stop(), which raise, are closed as
+# incomplete on the way out.
+
+def begin_run(label):
+    if getattr(_local, "run", None) is not None:
+        end_run(complete=False)
+    if not ENABLED:
+        return
+    _local.run = {"label": label, "started": time.time(), "start": time.perf_counter(),
+                  "spans": {}, "counters": {}, "section": None}
+
+
+class script_run:
+    """Context manager wrapping begin_run() and end_run() around a rerun."""
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        begin_run(self.label)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_run(complete=exc_type is None)
+
+
+def section(name):
+    """Starts timing span name, ending the previous section of this run."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    _close_section(run)
+    run["section"] = (name, time.perf_counter())
+
+
+def _close_section(run):
+    if run["section"] is not None:
+        name, start = run["section"]
+        observe(name, time.perf_counter() - start)
+        run["section"] = None
+
+
+def end_run(complete=True):
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    _local.run = None
+    _close_section(run)
+    seconds = time.perf_counter() - run["start"]
+    observe("run", seconds)
+    record = {"label": run["label"], "started": run["started"], "seconds": seconds,
+              "complete": complete, "spans": run["spans"], "counters": run["counters"]}
+    with _lock:
+        _runs.append(record)
+    _export(record)
+
+
+def recent_runs():
+    with _lock:
+        return list(_runs)
+
+
+def snapshot():
+    """{"spans": {name: stats}, "counters": {name: value}} over what was recorded so far.
+
+    Span stats are count, total and errors since start plus mean, max and
+    QUANTILES over the last RECENT_SAMPLES durations.
+    """
+    with _lock:
+        spans = {name: (s.count, s.total, s.errors, sorted(s.recent)) for name, s in _series.items()}
+        counters = dict(_counters)
+    stats = {}
+    for name, (n, total, errors, recent) in spans.items():
+        stats[name] = {
+            "count": n, "total_s": total, "errors": errors,
+            "mean_s": sum(recent) / len(recent), "max_s": recent[-1],
+            **{f"p{int(q * 100)}_s": recent[min(len(recent) - 1, int(q * len(recent)))] for q in QUANTILES},
+        }
+    return {"spans": stats, "counters": counters}
+
+
+def reset():
+    with _lock:
+        _series.clear()
+        _counters.clear()
+        _runs.clear()
+
+
+# -----------------------------
+# EXPORT
+# -----------------------------
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{PROMETHEUS_PREFIX}_{name}")
+
+
+def prometheus_text():
+    """Every span and counter in the Prometheus text exposition format."""
+    snap = snapshot()
+    span_metric = _metric_name("span_seconds")
+    lines = [f"# HELP {span_metric} Duration of instrumented code paths.", f"# TYPE {span_metric} summary"]
+    for name, s in sorted(snap["spans"].items()):
+        label = json.dumps(name)
+        for q in QUANTILES:
+            lines.append(f'{span_metric}{{span={label},quantile="{q}"}} {s[f"p{int(q * 100)}_s"]:.6f}')
+        lines.append(f"{span_metric}_sum{{span={label}}} {s['total_s']:.6f}")
+        lines.append(f"{span_metric}_count{{span={label}}} {s['count']}")
+    errors_metric = _metric_name("span_errors_total")
+    lines += [f"# TYPE {errors_metric} counter"]
+    lines += [f"{errors_metric}{{span={json.dumps(name)}}} {s['errors']}" for name, s in sorted(snap["spans"].items())]
+    for name, value in sorted(snap["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def runs_jsonl():
+    return "".join(json.dumps(run) + "\n" for run in recent_runs())
+
+
+def write_prometheus(path):
+    """Atomically replaces path with prometheus_text()."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def _export(record):
+    global _last_export
+    if JSONL_PATH:
+        with _lock, open(JSONL_PATH, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    if EXPORT_PATH and time.monotonic() - _last_export >= EXPORT_INTERVAL_S:
+        _last_export = time.monotonic()
+        write_prometheus(EXPORT_PATH)
@@ -0,0 +1,497 @@
+import datetime
+import os
+import re
+import threading
+import zlib
+from operator import itemgetter
+
+import numpy as np
+
+import database
+import jobs
+import metrics
+
+# Similar-incident index. Each incident is a hashed TF-IDF vector over its
+# description and action_taken: tokens and adjacent-token pairs are hashed
+# into N_FEATURES buckets, so there is no vocabulary to store or grow.
+# Vectors are kept as an inverted index (per feature, the rows that have
+# it), so a query only touches the rows sharing a term with it.
+#
+# New incidents go to a small tail that is searched by brute force; once it
+# holds TAIL_MAX rows it is merged into the inverted index, IDF weights are
+# refreshed, edited and deleted rows are dropped and the result is saved
+# next to the database. A restart loads that file and catches up through
+# incident_changes(), so every writer (the form, ingest, bulk loads) is seen.
+# Loading or building the index is a background job for the Officer form,
+# which skips the duplicate check until it is ready.
+N_FEATURES = 2 ** 18
+DESCRIPTION_WEIGHT = 2          # description terms count double, as in search ranking
+ACTION_WEIGHT = 1
+MAX_DF = 0.5                    # terms in more than half the log are skipped at query time
+TAIL_MAX = 5000
+BUILD_CHUNK = 20000
+INDEX_FORMAT = 1
+FEATURE_CACHE_MAX = 500_000
+SYNC_COLUMNS = ("id", "terminal_id", "ts", "description", "action_taken")
+
+DEFAULT_K = 5
+MIN_SCORE = 0.05
+TIE_MARGIN = 1e-6               # float32 norms make equal texts score a hair apart
+DUPLICATE_THRESHOLD = 0.8       # cosine similarity for the Officer form warning
+DUPLICATE_WINDOW_DAYS = 30
+
+# Recurrence clusters: incidents at one terminal within the last
+# RECURRENCE_DAYS whose descriptions are at least RECURRENCE_THRESHOLD
+# similar, linked transitively. Only the newest RECURRENCE_MAX_DOCS per
+# terminal are compared, which bounds the pairwise work.
+RECURRENCE_DAYS = 30
+RECURRENCE_THRESHOLD = 0.6
+RECURRENCE_MIN_SIZE = 3
+RECURRENCE_MAX_DOCS = 1500
+
+STOPWORDS = frozenset("""
+    a an and are as at be been but by for from had has have he her his in into is it its of on or our
+    she so than that the their then there these they this to was we were when which while who will with
+    after again all also any before being both did do does during each few more most no not off only
+    other out over same some such too under until up very what where why
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Sublinear term frequency, indexed by the stored (capped) count
+_TF = np.concatenate([[0.0], 1.0 + np.log(np.arange(1, 256))]).astype(np.float32)
+
+_features = {}
+
+
+def tokens(text):
+    """Lower-cased words (stopwords and single characters dropped, plurals
+    folded) followed by each pair of adjacent words."""
+    words = []
+    for word in _TOKEN_RE.findall((text or "").lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _feature(token):
+    feature = _features.get(token)
+    if feature is None:
+        if len(_features) >= FEATURE_CACHE_MAX:
+            _features.clear()
+        feature = _features[token] = zlib.crc32(token.encode()) & (N_FEATURES - 1)
+    return feature
+
+
+def term_counts(description, action_taken=None, action_weight=ACTION_WEIGHT):
+    """{feature: weighted count} for one incident's text."""
+    counts = {}
+    for weight, text in ((DESCRIPTION_WEIGHT, description), (action_weight, action_taken)):
+        if weight:
+            for token in tokens(text):
+                feature = _feature(token)
+                counts[feature] = counts.get(feature, 0) + weight
+    return counts
+
+
+def _arrays(counts):
+    features = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    return features, np.minimum(values, 255).astype(np.uint8)
+
+
+def index_path(db_name=None):
+    return os.path.splitext(db_name or database.DB_NAME)[0] + ".similarity.npz"
+
+
+class SimilarityIndex:
+    """Hashed TF-IDF vectors of every incident, for top-k similarity queries.
+
+    Row r describes incident ids[r]. The merged part is an inverted index:
+    for feature f, post_row[colptr[f]:colptr[f + 1]] are the rows having it
+    and post_count the matching weighted counts. Rows from base_rows on are
+    the tail, still held as per-row arrays.
+    """
+
+    def __init__(self, db_name=None):
+        self.db_name = db_name
+        self.path = index_path(db_name)
+        self.version = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.terminal = np.zeros(0, dtype=np.int64)
+        self.ts = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.df = np.zeros(N_FEATURES, dtype=np.int64)
+        self.idf = np.ones(N_FEATURES, dtype=np.float32)
+        self.colptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        self.post_row = np.zeros(0, dtype=np.int32)
+        self.post_count = np.zeros(0, dtype=np.uint8)
+        self.base_rows = 0
+        self._tail = []                 # (rows, features, counts) arrays per appended batch
+        self._tail_arrays = None
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # ---- updates ----
+
+    @metrics.timed("similarity.sync")
+    def sync(self, build=True):
+        """Brings the index up to the database; returns how many rows changed.
+
+        With build False an index that would have to be built from scratch
+        is left empty and None is returned.
+        """
+        with self._lock:
+            if self.version is None:
+                self._load()
+            current = database.data_version()
+            if self.version is not None and current < self.version:
+                self._reset()
+                self.version = None         # a different or restored database: start over
+            if self.version is None:
+                return self._build() if build else None
+            if current == self.version:
+                return 0
+
+            rows, deleted, version = database.incident_changes(self.version, columns=SYNC_COLUMNS)
+            if deleted is None:
+                # The tombstones we had not seen were pruned: compare ids instead
+                deleted = self.ids[self.alive & ~np.isin(self.ids, database.incident_ids())].tolist()
+            changed = deleted + [row[0] for row in rows]
+            if changed:
+                self.alive &= ~np.isin(self.ids, changed)
+            self._append(rows)
+            self.version = version
+            if len(self.ids) - self.base_rows >= TAIL_MAX:
+                self._merge()
+                self._save()
+            return len(changed)
+
+    def _append(self, rows):
+        if not rows:
+            return
+        start = len(self.ids)
+        lengths, features, counts = [], [], []
+        for _, _, _, description, action_taken in rows:
+            doc = term_counts(description, action_taken)
+            lengths.append(len(doc))
+            features.extend(doc)
+            counts.extend(doc.values())
+        features = np.array(features, dtype=np.int32)
+        counts = np.minimum(np.array(counts, dtype=np.int64), 255).astype(np.uint8)
+        local_row = np.repeat(np.arange(len(rows), dtype=np.int32), lengths)
+        self.df += np.bincount(features, minlength=N_FEATURES)
+        weights = _TF[counts] * self.idf[features]
+        norms = np.sqrt(np.bincount(local_row, weights * weights, minlength=len(rows)))
+
+        self.ids = np.concatenate([self.ids, [row[0] for row in rows]]).astype(np.int64)
+        self.terminal = np.concatenate([self.terminal, [-1 if row[1] is None else row[1] for row in rows]]).astype(np.int64)
+        self.ts = np.concatenate([self.ts, np.array([row[2] for row in rows], dtype=np.float64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+        self.norms = np.concatenate([self.norms, norms.astype(np.float32)])
+        self._tail.append((local_row + start, features, counts))
+        self._tail_arrays = None
+
+    def _build(self):
+        """Indexes every incident from scratch, BUILD_CHUNK rows at a time."""
+        self._reset()
+        self.version = database.data_version()
+        n = 0
+        # Rows changed during the scan carry a later change_seq than the
+        # version read above, so the next sync applies them again
+        for rows in database.iter_incidents(columns=SYNC_COLUMNS, chunk_size=BUILD_CHUNK):
+            self._append(rows)
+            n += len(rows)
+        self._merge()
+        self._save()
+        return n
+
+    def _merge(self):
+        """Folds the tail into the inverted index, dropping dead rows.
+
+        Linear in the index size: each feature's merged rows land right
+        after its kept base rows, so nothing is re-sorted but the tail.
+        """
+        keep = self.alive
+        new_row = np.cumsum(keep) - 1
+
+        base_feature = np.repeat(np.arange(N_FEATURES, dtype=np.int32), np.diff(self.colptr))
+        base_keep = keep[self.post_row]
+        base_feature, base_row, base_count = (
+            base_feature[base_keep], self.post_row[base_keep], self.post_count[base_keep])
+
+        tail_row, tail_feature, tail_count = self._tail_postings()
+        order = np.argsort(tail_feature, kind="stable")
+        tail_row, tail_feature, tail_count = tail_row[order], tail_feature[order], tail_count[order]
+        tail_keep = keep[tail_row]
+        tail_row, tail_feature, tail_count = tail_row[tail_keep], tail_feature[tail_keep], tail_count[tail_keep]
+
+        base_df = np.bincount(base_feature, minlength=N_FEATURES)
+        tail_df = np.bincount(tail_feature, minlength=N_FEATURES)
+        df = base_df + tail_df
+        colptr = np.concatenate([[0], np.cumsum(df)])
+        base_start = np.concatenate([[0], np.cumsum(base_df)])
+        tail_start = np.concatenate([[0], np.cumsum(tail_df)])
+
+        post_row = np.empty(colptr[-1], dtype=np.int32)
+        post_count = np.empty(colptr[-1], dtype=np.uint8)
+        pos = colptr[base_feature] + np.arange(len(base_feature)) - base_start[base_feature]
+        post_row[pos], post_count[pos] = new_row[base_row], base_count
+        pos = colptr[tail_feature] + base_df[tail_feature] + np.arange(len(tail_feature)) - tail_start[tail_feature]
+        post_row[pos], post_count[pos] = new_row[tail_row], tail_count
+
+        self.ids, self.terminal, self.ts = self.ids[keep], self.terminal[keep], self.ts[keep]
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.colptr, self.post_row, self.post_count = colptr, post_row, post_count
+        self.base_rows = len(self.ids)
+        self._tail, self._tail_arrays = [], None
+        self.df = df
+        self._refresh_weights()
+
+    def _refresh_weights(self):
+        """IDF from the current document frequencies, and every row's norm."""
+        n = len(self.ids)
+        self.idf = (np.log((1.0 + n) / (1.0 + self.df)) + 1.0).astype(np.float32)
+        feature = np.repeat(np.arange(N_FEATURES, dtype=np.int32), np.diff(self.colptr))
+        weights = _TF[self.post_count] * self.idf[feature]
+        self.norms = np.sqrt(np.bincount(self.post_row, weights * weights, minlength=n)).astype(np.float32)
+
+    def _tail_postings(self):
+        if self._tail_arrays is None:
+            if self._tail:
+                self._tail_arrays = tuple(np.concatenate(part) for part in zip(*self._tail))
+            else:
+                self._tail_arrays = (np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.uint8))
+        return self._tail_arrays
+
+    # ---- persistence ----
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, format=INDEX_FORMAT, n_features=N_FEATURES, version=self.version,
+                 ids=self.ids, terminal=self.terminal, ts=self.ts, df=self.df,
+                 colptr=self.colptr, post_row=self.post_row, post_count=self.post_count)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        """Reads the saved index if it matches this build; False otherwise."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as saved:
+                if int(saved["format"]) != INDEX_FORMAT or int(saved["n_features"]) != N_FEATURES:
+                    return False
+                self._reset()
+                self.ids, self.terminal, self.ts = saved["ids"], saved["terminal"], saved["ts"]
+                self.df, self.colptr = saved["df"], saved["colptr"]
+                self.post_row, self.post_count = saved["post_row"], saved["post_count"]
+                self.version = int(saved["version"])
+        except (OSError, ValueError, KeyError):
+            self._reset()
+            return False
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.base_rows = len(self.ids)
+        self._refresh_weights()
+        return True
+
+    # ---- queries ----
+
+    @metrics.timed("similarity.query")
+    def query(self, counts, k=DEFAULT_K, terminal_id=None, since=None, exclude=()):
+        """[(incident_id, score)] for the k rows most similar to the term
+        counts, best first. Scores are cosine similarities in (0, 1]."""
+        if not counts:
+            return []
+        with self._lock:
+            n = len(self.ids)
+            if not n:
+                return []
+            features, query_counts = _arrays(counts)
+            idf = self.idf[features]
+            query_weight = _TF[query_counts] * idf
+            query_norm = float(np.sqrt(np.dot(query_weight, query_weight)))
+            # A term in most incidents adds little to any score but costs a
+            # pass over most of the index
+            useful = self.df[features] <= MAX_DF * n
+            features, scale = features[useful], (query_weight * idf)[useful]
+            if not len(features):
+                return []
+
+            row_parts, weight_parts = [], []
+            for feature, weight in zip(features.tolist(), scale.tolist()):
+                lo, hi = self.colptr[feature], self.colptr[feature + 1]
+                row_parts.append(self.post_row[lo:hi])
+                weight_parts.append(_TF[self.post_count[lo:hi]] * weight)
+            tail_row, tail_feature, tail_count = self._tail_postings()
+            if len(tail_row):
+                order = np.argsort(features)
+                slot = np.minimum(np.searchsorted(features, tail_feature, sorter=order), len(features) - 1)
+                hit = features[order[slot]] == tail_feature
+                row_parts.append(tail_row[hit])
+                weight_parts.append(_TF[tail_count[hit]] * scale[order[slot[hit]]])
+
+            scores = np.bincount(np.concatenate(row_parts), np.concatenate(weight_parts), minlength=n)
+            rows = np.flatnonzero(scores)
+            keep = self.alive[rows]
+            if terminal_id is not None:
+                keep &= self.terminal[rows] == terminal_id
+            if since is not None:
+                keep &= self.ts[rows] >= since
+            if exclude:
+                keep &= ~np.isin(self.ids[rows], list(exclude))
+            rows = rows[keep]
+            rows_scores = scores[rows] / (self.norms[rows] * query_norm)
+            good = rows_scores >= MIN_SCORE
+            rows, rows_scores = rows[good], rows_scores[good]
+            if len(rows) > k:
+                # Everything within TIE_MARGIN of the k-th score stays in, so
+                # equal scores are cut by the tie-break below, not at random
+                kth = np.partition(-rows_scores, k - 1)[k - 1]
+                near = -rows_scores <= kth + TIE_MARGIN
+                rows, rows_scores = rows[near], rows_scores[near]
+            order = np.lexsort((-self.ids[rows], -rows_scores))[:k]      # ties: newest first
+            return [(int(self.ids[r]), min(float(s), 1.0)) for r, s in zip(rows[order], rows_scores[order])]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_name=None, wait=True):
+    """The shared index for a database file (DB_NAME by default), synced.
+
+    When the index still has to be loaded or built and wait is False, that
+    happens in a background job and None is returned until it is done.
+    """
+    db_name = db_name or database.DB_NAME
+    with _indexes_lock:
+        index = _indexes.get(db_name)
+        if index is None and wait:
+            index = _indexes[db_name] = SimilarityIndex(db_name)
+    if index is None or index.sync(build=wait) is None:
+        jobs.submit("similarity", db_name, warm, db_name)
+        return None
+    return index
+
+
+def warm(db_name=None, progress=None):
+    """Loads or builds the index for db_name, then makes it the shared one.
+
+    The work happens on a private index, so queries go on meanwhile; returns
+    how many incidents it holds.
+    """
+    db_name = db_name or database.DB_NAME
+    index = SimilarityIndex(db_name)
+    index.sync()
+    with _indexes_lock:
+        _indexes[db_name] = index
+    return len(index)
+
+
+def similar_incidents(description, action_taken=None, k=DEFAULT_K, terminal=None, since=None, exclude=(),
+                      wait=True):
+    """[(incident_id, score)] for the k incidents whose text is most like this, best first.
+
+    terminal limits the search to one terminal name, since to incidents on or
+    after a date (anything database.to_epoch takes), exclude skips ids. With
+    wait False nothing is found until the index is ready (see get_index).
+    """
+    index = get_index(wait=wait)
+    if index is None:
+        return []
+    terminal_id = None
+    if terminal is not None:
+        ids = {name: key for key, name in database.dimension_names("terminal").items()}
+        if terminal not in ids:
+            return []
+        terminal_id = ids[terminal]
+    return index.query(term_counts(description, action_taken), k, terminal_id, database.to_epoch(since), exclude)
+
+
+def find_duplicate(description, action_taken, terminal, threshold=DUPLICATE_THRESHOLD,
+                   window_days=DUPLICATE_WINDOW_DAYS):
+    """(incident_id, score) of a recent report at the same terminal that reads
+    like this one, or None. Never waits for the index to be built."""
+    since = datetime.datetime.now() - datetime.timedelta(days=window_days)
+    matches = similar_incidents(description, action_taken, k=1, terminal=terminal, since=since, wait=False)
+    if matches and matches[0][1] >= threshold:
+        return matches[0]
+    return None
+
+
+def _components(adjacent):
+    """Connected-component label per node of a boolean adjacency matrix."""
+    labels = np.arange(len(adjacent))
+    while True:
+        # Every node takes the smallest label among its neighbours (itself included)
+        spread = np.where(adjacent, labels[None, :], len(labels)).min(axis=1)
+        spread = spread[spread]
+        if np.array_equal(spread, labels):
+            return labels
+        labels = spread
+
+
+def recurrence_clusters(incidents, days=RECURRENCE_DAYS, threshold=RECURRENCE_THRESHOLD,
+                        min_size=RECURRENCE_MIN_SIZE, max_docs=RECURRENCE_MAX_DOCS):
+    """Groups of near-identical reports at one terminal in the last `days`.
+
+    incidents are row tuples (id, terminal, type, severity, description,
+    action, date, ...). Returns dicts with terminal, ids (newest first),
+    description (of the newest), first and last date, largest group first.
+    """
+    latest = max(filter(None, map(itemgetter(6), incidents)), default=None)
+    if latest is None:
+        return []
+    cutoff = str(datetime.datetime.fromisoformat(latest[:19]) - datetime.timedelta(days=days))
+    by_terminal = {}
+    for row in incidents:
+        if (row[6] or "") >= cutoff:
+            by_terminal.setdefault(row[1], []).append(row)
+
+    window = [row for rows in by_terminal.values() for row in rows]
+    vectors = {row[0]: _arrays(term_counts(row[4], action_weight=0)) for row in window}
+    df = np.bincount(np.concatenate([features for features, _ in vectors.values()]), minlength=N_FEATURES)
+    idf = (np.log((1.0 + len(window)) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    clusters = []
+    for terminal, rows in by_terminal.items():
+        rows = sorted(rows, key=itemgetter(6), reverse=True)[:max_docs]
+        if len(rows) < min_size:
+            continue
+        docs = [vectors[row[0]] for row in rows]
+        # Only features shared by two reports here can link them; the rest
+        # only count towards the norms
+        feature_all = np.concatenate([features for features, _ in docs])
+        shared, local_df = np.unique(feature_all, return_counts=True)
+        shared = shared[local_df >= 2]
+        matrix = np.zeros((len(rows), len(shared)), dtype=np.float32)
+        norms = np.zeros(len(rows), dtype=np.float32)
+        for i, (features, doc_counts) in enumerate(docs):
+            weights = _TF[doc_counts] * idf[features]
+            norms[i] = np.sqrt(np.dot(weights, weights))
+            slot = np.searchsorted(shared, features)
+            hit = (slot < len(shared)) & (shared[np.minimum(slot, len(shared) - 1)] == features)
+            matrix[i, slot[hit]] = weights[hit]
+        norms[norms == 0] = 1.0
+        matrix /= norms[:, None]
+        adjacent = matrix @ matrix.T >= threshold
+        np.fill_diagonal(adjacent, True)
+        labels = _components(adjacent)
+        for label, size in zip(*np.unique(labels, return_counts=True)):
+            if size < min_size:
+                continue
+            members = [rows[i] for i in np.flatnonzero(labels == label)]      # newest first
+            clusters.append({
+                "terminal": terminal, "ids": [row[0] for row in members],
+                "description": members[0][4], "first": members[-1][6], "last": members[0][6],
+            })
+    clusters.sort(key=lambda c: (len(c["ids"]), c["last"]), reverse=True)
+    return clusters
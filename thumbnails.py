@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import connection, transaction
+
+THUMB_DIR = "thumbnail_cache"
+THUMB_SIZE = (320, 320)
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024
+MAX_WORKERS = 2
+
+# One row per rendered thumbnail, keyed by the evidence content hash, so
+# identical files share a thumbnail and lookups are a primary-key read.
+THUMBNAIL_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS thumbnails (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_thumbnails_last_used ON thumbnails(last_used)",
+)
+
+_executor = None
+_pending = {}            # sha256 -> Future, so a file is never rendered twice at once
+_recent_use = {}         # sha256 -> time, flushed to the table before evicting
+_no_preview = set()      # files that cannot be previewed; not retried this process
+_lock = threading.Lock()
+
+
+def create_thumbnail_table(conn):
+    """Schema migration step."""
+    for ddl in THUMBNAIL_DDL:
+        conn.execute(ddl)
+
+
+def thumb_path(sha256):
+    return os.path.join(THUMB_DIR, sha256[:2], f"{sha256}.jpg")
+
+
+def render_thumbnail(source_path, mime_type, out_path, size=THUMB_SIZE):
+    """Writes a downscaled JPEG of an image or a PDF's first page.
+
+    Runs in a worker process. Returns the output size in bytes, or None when
+    the type has no preview (or the PDF renderer is not installed).
+    """
+    from PIL import Image
+
+    if mime_type in ("image/png", "image/jpeg"):
+        img = Image.open(source_path)
+        img.draft("RGB", size)   # JPEG: decode at reduced scale instead of full size
+    elif mime_type == "application/pdf":
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            return None
+        pdf = pdfium.PdfDocument(source_path)
+        try:
+            page = pdf[0]
+            scale = min(size[0] / page.get_width(), size[1] / page.get_height())
+            img = page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    else:
+        return None
+
+    img.thumbnail(size)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.part"
+    img.save(tmp_path, "JPEG", quality=80, optimize=True)
+    os.replace(tmp_path, out_path)
+    return os.path.getsize(out_path)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the Streamlit server process is heavily threaded
+        _executor = ProcessPoolExecutor(
+            max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def schedule(sha256, path, mime_type):
+    """Queues a thumbnail render for a stored file unless it exists or is queued."""
+    with _lock:
+        if sha256 in _no_preview:
+            return None
+        if sha256 in _pending:
+            return _pending[sha256]
+    with connection() as conn:
+        if conn.execute("SELECT 1 FROM thumbnails WHERE sha256 = ?", (sha256,)).fetchone():
+            return None
+
+    with _lock:
+        if sha256 in _pending:
+            return _pending[sha256]
+        future = _get_executor().submit(
+            render_thumbnail, os.path.abspath(path), mime_type, os.path.abspath(thumb_path(sha256))
+        )
+        _pending[sha256] = future
+    future.add_done_callback(lambda f: _on_done(sha256, f))
+    return future
+
+
+def _on_done(sha256, future):
+    with _lock:
+        _pending.pop(sha256, None)
+    try:
+        size = future.result()
+    except Exception:
+        size = None   # unreadable or corrupt upload: the full file is still downloadable
+    if size is None:
+        with _lock:
+            _no_preview.add(sha256)
+        return
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO thumbnails (sha256, path, size, last_used) VALUES (?, ?, ?, ?)",
+            (sha256, thumb_path(sha256), size, time.time()),
+        )
+    evict()
+
+
+def thumbnail_paths(blobs):
+    """Maps sha256 -> thumbnail path for the ready ones among (sha256, path, mime) blobs.
+
+    Missing thumbnails, including ones whose file has gone from disk, are
+    queued in the background, so they show up on a later rerun without this
+    call ever waiting on a render.
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return {}
+    shas = [b[0] for b in blobs]
+    with connection() as conn:
+        ready = dict(conn.execute(
+            f"SELECT sha256, path FROM thumbnails WHERE sha256 IN ({', '.join('?' * len(shas))})", shas
+        ).fetchall())
+
+    # A thumbnail file deleted behind the table's back (by hand, or another
+    # process's evict) is forgotten here and rendered again
+    gone = [sha256 for sha256, path in ready.items() if not os.path.exists(path)]
+    if gone:
+        with transaction() as conn:
+            conn.executemany("DELETE FROM thumbnails WHERE sha256 = ?", [(sha,) for sha in gone])
+        for sha256 in gone:
+            del ready[sha256]
+
+    now = time.time()
+    with _lock:
+        for sha256 in ready:
+            _recent_use[sha256] = now
+    for sha256, path, mime_type in blobs:
+        if sha256 not in ready:
+            schedule(sha256, path, mime_type)
+    return ready
+
+
+def evict(max_bytes=THUMB_CACHE_MAX_BYTES):
+    """Deletes least recently used thumbnails until the cache fits max_bytes."""
+    with _lock:
+        touched = list(_recent_use.items())
+        _recent_use.clear()
+
+    removed = []
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE thumbnails SET last_used = MAX(last_used, ?) WHERE sha256 = ?",
+            [(t, sha) for sha, t in touched],
+        )
+        total = conn.execute("SELECT IFNULL(SUM(size), 0) FROM thumbnails").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        for sha256, path, size in conn.execute(
+            "SELECT sha256, path, size FROM thumbnails ORDER BY last_used"
+        ).fetchall():
+            if total <= max_bytes:
+                break
+            removed.append((sha256, path))
+            total -= size
+        conn.executemany("DELETE FROM thumbnails WHERE sha256 = ?", [(sha,) for sha, _ in removed])
+
+    for _, path in removed:
+        if os.path.exists(path):
+            os.remove(path)
+    return len(removed)